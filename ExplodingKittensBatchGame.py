@@ -0,0 +1,280 @@
+import json
+
+import numpy as np
+
+from ExplodingKittensGame import HAND_CARDS, DEFUSE_INDEX, ATTACK_INDEX, SKIP_INDEX, \
+    FAVOR_INDEX, SHUFFLE_INDEX, CAT_INDICES
+
+# N games of ExplodingKittensGame held as NumPy arrays and advanced together:
+# step(actions) applies one action to every game with array operations, so
+# there is no Python work per game. Cards are the hand ordinals of
+# ExplodingKittensGame (HAND_CARDS), with EXPLODING_KITTEN after them.
+#
+# Actions are a card ordinal to play that card, or DRAW_ACTION to draw. An
+# action that is not playable leaves its game unchanged, as play_card does,
+# and finished games ignore their actions until they are reset. Favor and cat
+# steals take a random card from a random opponent that is in and holds
+# cards, since there is no opponent selection.
+
+NUM_HAND_CARDS = len(HAND_CARDS)
+EXPLODING_KITTEN = NUM_HAND_CARDS
+NUM_CARD_TYPES = NUM_HAND_CARDS + 1
+DRAW_ACTION = NUM_HAND_CARDS
+NUM_ACTIONS = NUM_HAND_CARDS + 1
+NO_CARD = -1
+
+CARD_DTYPE = np.int8
+
+
+def config_deck(game_config) -> np.ndarray:
+    # the cards put in the deck before dealing, as ordinals
+    counts = [game_config['num_' + card.value.lower() + '_cards'] for card in HAND_CARDS]
+    return np.repeat(np.arange(NUM_HAND_CARDS, dtype=CARD_DTYPE), counts)
+
+
+def deal_games(game_config, num_games, rng, kitten_on_top=True):
+    # Deal num_games games as ExplodingKittensGame.reset does: shuffle the
+    # config deck, deal the starting hands off the top and add the starting
+    # defuses, then insert the exploding kittens at random positions. Each
+    # row is its own permutation of the config deck. Inserting the kittens
+    # one at a time at uniform positions gives every choice of kitten
+    # positions the same probability, so the kittens' positions are drawn in
+    # one go and the rest of the deck fills the other slots in order.
+    # kitten_on_top=False inserts below the top card, as game.Game and
+    # game2.EKGameV0 do.
+    # Returns (decks, deck_lengths, hands); the top of a deck is its last card.
+    template = config_deck(game_config)
+    num_players = game_config['num_players']
+    hand_size = game_config['num_cards_in_starting_hand']
+    num_eks = num_players - 1
+
+    shuffled = rng.permuted(np.broadcast_to(template, (num_games, len(template))), axis=1)
+
+    num_dealt = num_players * hand_size
+    remaining = len(template) - num_dealt
+    dealt = shuffled[:, remaining:].reshape(num_games, num_players, hand_size)
+    hands = (dealt[..., None] == np.arange(NUM_HAND_CARDS)).sum(axis=2, dtype=CARD_DTYPE)
+    hands[:, :, DEFUSE_INDEX] += game_config['num_defuse_cards_in_starting_hand']
+
+    deck_size = remaining + num_eks
+    num_slots = deck_size if kitten_on_top else deck_size - 1
+    slots = np.argsort(rng.random((num_games, num_slots)), axis=1)[:, :num_eks]
+    is_ek = np.zeros((num_games, deck_size), dtype=bool)
+    np.put_along_axis(is_ek, slots, True, axis=1)
+    decks = np.full((num_games, deck_size), EXPLODING_KITTEN, dtype=CARD_DTYPE)
+    decks[~is_ek] = shuffled[:, :remaining].ravel()
+
+    return decks, np.full(num_games, deck_size), hands
+
+
+def deal_stream(game_config, batch_size, seed=None, kitten_on_top=True):
+    # Endless (deck, hands) initial deals as lists of ordinals, dealt
+    # batch_size at a time by deal_games. A deck lists its cards bottom to
+    # top and hands has one list of counts per player; both are new lists
+    # each time, for the taker to own.
+    rng = np.random.default_rng(seed)
+    while True:
+        decks, _, hands = deal_games(game_config, batch_size, rng, kitten_on_top)
+        yield from zip(decks.tolist(), hands.tolist())
+
+
+class ExplodingKittensBatchGame:
+    def __init__(self, config_file, num_games, seed=None):
+        with open(config_file, "r") as f:
+            self.game_config = json.load(f)
+
+        self.num_games = num_games
+        self.num_players = self.game_config['num_players']
+        self.rng = np.random.default_rng(seed)
+        self._games = np.arange(num_games)
+
+        self.reset()
+
+    def reset(self, games=None) -> None:
+        # Deal new games into the rows selected by `games` (a boolean mask or
+        # indices), or into every row
+        if games is None:
+            decks, self.deck_lengths, self.hands = deal_games(
+                self.game_config, self.num_games, self.rng)
+            self.decks = decks
+            self.hand_sizes = self.hands.sum(axis=2, dtype=np.int64)
+            self.current_player = np.zeros(self.num_games, dtype=np.int64)
+            self.is_out = np.zeros((self.num_games, self.num_players), dtype=bool)
+            self.num_attacks = np.zeros(self.num_games, dtype=np.int64)
+            self.discard_counts = np.zeros((self.num_games, NUM_CARD_TYPES), dtype=np.int64)
+            self._playable = None
+            return
+
+        games = self._games[games] if np.asarray(games).dtype == bool else np.asarray(games)
+        decks, self.deck_lengths[games], self.hands[games] = deal_games(
+            self.game_config, len(games), self.rng)
+        self.decks[games] = decks
+        self.hand_sizes[games] = self.hands[games].sum(axis=2)
+        self.current_player[games] = 0
+        self.is_out[games] = False
+        self.num_attacks[games] = 0
+        self.discard_counts[games] = 0
+        self._playable = None
+
+    @property
+    def game_over(self) -> np.ndarray:
+        return (self.deck_lengths == 0) | (self.is_out.sum(axis=1) >= self.num_players - 1)
+
+    @property
+    def winner(self) -> np.ndarray:
+        # the player left in, or -1 while the game is on
+        last_in = np.argmax(~self.is_out, axis=1)
+        return np.where(self.is_out.sum(axis=1) == self.num_players - 1, last_in, -1)
+
+    @property
+    def current_hand(self) -> np.ndarray:
+        return self.hands[self._games, self.current_player]
+
+    def _opponents_with_cards(self, games) -> np.ndarray:
+        # (games, players) mask of the opponents a favor or cat card can steal from
+        eligible = (self.hand_sizes[games] > 0) & ~self.is_out[games]
+        eligible[np.arange(len(games)), self.current_player[games]] = False
+        return eligible
+
+    def playable(self) -> np.ndarray:
+        # (N, NUM_HAND_CARDS) mask of the cards each current player can play,
+        # by the rules of ExplodingKittensGameState.playable_card_types. Kept
+        # until the next step or reset; do not modify it.
+        if self._playable is None:
+            hand = self.current_hand
+            can_steal = self._opponents_with_cards(self._games).any(axis=1)
+            playable = hand > 0
+            playable[:, DEFUSE_INDEX] = False
+            playable[:, FAVOR_INDEX] &= can_steal
+            playable[:, CAT_INDICES] &= (hand[:, CAT_INDICES] >= 2) & can_steal[:, None]
+            self._playable = playable
+        return self._playable
+
+    def legal_actions(self) -> np.ndarray:
+        # (N, NUM_ACTIONS) mask; drawing is always legal in a game that is on
+        legal = np.zeros((self.num_games, NUM_ACTIONS), dtype=bool)
+        legal[:, :NUM_HAND_CARDS] = self.playable()
+        legal[:, DRAW_ACTION] = True
+        legal[self.game_over] = False
+        return legal
+
+    def random_actions(self) -> np.ndarray:
+        # a uniformly random legal action for every game (DRAW_ACTION for
+        # finished games, which ignore it)
+        legal = self.legal_actions()
+        legal[~legal.any(axis=1), DRAW_ACTION] = True
+        return np.argmax(self.rng.random(legal.shape) * legal, axis=1)
+
+    def step(self, actions) -> np.ndarray:
+        # Apply actions[i] to game i. Returns the game_over mask.
+        actions = np.asarray(actions)
+        on = ~self.game_over
+
+        draws = np.flatnonzero(on & (actions == DRAW_ACTION))
+
+        cards = np.minimum(actions, NUM_HAND_CARDS - 1)
+        plays = on & (actions < NUM_HAND_CARDS) & (actions >= 0) \
+            & self.playable()[self._games, cards]
+        plays = np.flatnonzero(plays)
+
+        self._draw(draws)
+        self._play(plays, actions[plays])
+        self._playable = None
+
+        return self.game_over
+
+    def _draw(self, games) -> None:
+        self.deck_lengths[games] -= 1
+        cards = self.decks[games, self.deck_lengths[games]]
+        self.decks[games, self.deck_lengths[games]] = NO_CARD
+        players = self.current_player[games]
+
+        kept = cards != EXPLODING_KITTEN
+        self.hands[games[kept], players[kept], cards[kept]] += 1
+        self.hand_sizes[games[kept], players[kept]] += 1
+
+        bombed = ~kept
+        defused = bombed & (self.hands[games, players, DEFUSE_INDEX] > 0)
+        self._defuse(games[defused], players[defused])
+
+        exploded = bombed & ~defused
+        self.is_out[games[exploded], players[exploded]] = True
+        self.discard_counts[games[exploded], EXPLODING_KITTEN] += 1
+
+        self._next_player(games)
+
+    def _defuse(self, games, players) -> None:
+        # Discard a defuse and put the kitten back at a random position below
+        # the top card (at the bottom of an empty deck), as draw_card does
+        self.hands[games, players, DEFUSE_INDEX] -= 1
+        self.hand_sizes[games, players] -= 1
+        self.discard_counts[games, DEFUSE_INDEX] += 1
+
+        lengths = self.deck_lengths[games]
+        positions = (self.rng.random(len(games)) * lengths).astype(np.int64)
+        columns = np.arange(self.decks.shape[1])
+        source = columns - (columns > positions[:, None])
+        decks = np.take_along_axis(self.decks[games], source, axis=1)
+        decks[columns == positions[:, None]] = EXPLODING_KITTEN
+        decks[columns > lengths[:, None]] = NO_CARD
+        self.decks[games] = decks
+        self.deck_lengths[games] += 1
+
+    def _play(self, games, cards) -> None:
+        players = self.current_player[games]
+        self.hands[games, players, cards] -= 1
+        self.discard_counts[games, cards] += 1
+
+        # a cat card is played as a pair
+        cats = np.isin(cards, CAT_INDICES)
+        self.hands[games[cats], players[cats], cards[cats]] -= 1
+        self.discard_counts[games[cats], cards[cats]] += 1
+        self.hand_sizes[games, players] -= 1 + cats
+
+        attacks = games[cards == ATTACK_INDEX]
+        self.num_attacks[attacks] += 2
+        self._next_player(attacks, attacked=True)
+
+        self._next_player(games[cards == SKIP_INDEX])
+        self._shuffle(games[cards == SHUFFLE_INDEX])
+        self._steal(games[cats | (cards == FAVOR_INDEX)])
+
+    def _shuffle(self, games) -> None:
+        # random keys sort the cards of a deck among themselves; the empty
+        # slots above its top get keys that keep them at the end
+        columns = np.arange(self.decks.shape[1])
+        keys = self.rng.random((len(games), len(columns)))
+        keys[columns >= self.deck_lengths[games][:, None]] = 2
+        order = np.argsort(keys, axis=1)
+        self.decks[games] = np.take_along_axis(self.decks[games], order, axis=1)
+
+    def _steal(self, games) -> None:
+        # a random opponent in with cards, then a card of theirs, each card
+        # equally likely
+        eligible = self._opponents_with_cards(games)
+        choice = (self.rng.random(len(games)) * eligible.sum(axis=1)).astype(np.int64)
+        opponents = np.argmax(np.cumsum(eligible, axis=1) > choice[:, None], axis=1)
+
+        players = self.current_player[games]
+        hands = self.hands[games, opponents]
+        choice = (self.rng.random(len(games)) * self.hand_sizes[games, opponents]).astype(np.int64)
+        cards = np.argmax(np.cumsum(hands, axis=1) > choice[:, None], axis=1)
+
+        self.hands[games, opponents, cards] -= 1
+        self.hands[games, players, cards] += 1
+        self.hand_sizes[games, opponents] -= 1
+        self.hand_sizes[games, players] += 1
+
+    def _next_player(self, games, attacked=False) -> None:
+        # ExplodingKittensGameState.next_player: a player under attack keeps
+        # the turn until their attack count runs out; otherwise the turn
+        # passes left to the next player that is in
+        if not attacked:
+            attacked_games = games[self.num_attacks[games] > 0]
+            self.num_attacks[attacked_games] -= 1
+            games = games[self.num_attacks[games] == 0]
+
+        steps = np.arange(1, self.num_players + 1)
+        candidates = (self.current_player[games, None] - steps) % self.num_players
+        is_in = ~self.is_out[games[:, None], candidates]
+        self.current_player[games] = candidates[np.arange(len(games)), np.argmax(is_in, axis=1)]
@@ -34,28 +34,47 @@ class Cards(str, Enum):
 def is_cat_card(card_type: Cards) -> bool:
     return True if 'CAT' in card_type else False
 
-def empty_hand() -> dict[Cards, int]:
-    return {
-        Cards.DEFUSE: 0,
-        Cards.ATTACK: 0,
-        Cards.SKIP: 0,
-        Cards.FAVOR: 0,
-        Cards.SHUFFLE: 0,
-        Cards.CAT1: 0,
-        Cards.CAT2: 0,
-        Cards.CAT3: 0,
-        Cards.CAT4: 0,
-        Cards.CAT5: 0,
-    }
+# Hands are lists of card counts indexed by card ordinal (the card types that
+# can be held, in Cards order), so the engine never hashes a Cards member to
+# look at a hand. The Cards-keyed dict is only built for JSON, by hand_dict
+# and game_state_dict.
+HAND_CARDS = [card for card in Cards if card != Cards.EXPLODING_KITTEN]
+CARD_INDEX = {card: i for i, card in enumerate(HAND_CARDS)}
+# cards by ordinal, the exploding kitten after the hand cards, as dealt by
+# ExplodingKittensBatchGame.deal_stream
+ORDINAL_CARDS = HAND_CARDS + [Cards.EXPLODING_KITTEN]
+
+DEFUSE_INDEX = CARD_INDEX[Cards.DEFUSE]
+ATTACK_INDEX = CARD_INDEX[Cards.ATTACK]
+SKIP_INDEX = CARD_INDEX[Cards.SKIP]
+FAVOR_INDEX = CARD_INDEX[Cards.FAVOR]
+SHUFFLE_INDEX = CARD_INDEX[Cards.SHUFFLE]
+CAT_INDICES = [i for i, card in enumerate(HAND_CARDS) if is_cat_card(card)]
+
+def empty_hand() -> list[int]:
+    return [0] * len(HAND_CARDS)
+
+def hand_dict(hand: list[int]) -> dict[Cards, int]:
+    return dict(zip(HAND_CARDS, hand))
+
+def _dict_factory(items):
+    return {key: hand_dict(value) if key == 'hand' else value for key, value in items}
+
+def game_state_dict(game_state) -> dict:
+    # asdict with each hand as a Cards-keyed dict, as clients expect
+    return asdict(game_state, dict_factory=_dict_factory)
 
 @dataclass
 class PlayerState:
-    hand: dict[Cards, int] = field(default_factory=empty_hand)
+    hand: list[int] = field(default_factory=empty_hand)
     is_out: bool = False
 
 class ExplodingKittensGame:
-    def __init__(self, config_file, debug=False):
+    def __init__(self, config_file, debug=False, deals=None):
+        # deals: an optional stream of initial deals for reset to take
+        # (ExplodingKittensBatchGame.deal_stream of the same config)
         self.debug = debug
+        self.deals = deals
         self.game_state = ExplodingKittensGameState()
 
         if config_file is None:
@@ -67,6 +86,12 @@ class ExplodingKittensGame:
         self.reset()
 
     def reset(self) -> None:
+        if self.deals is not None:
+            deck, hands = next(self.deals)
+            self.game_state = ExplodingKittensGameState(
+                [ORDINAL_CARDS[card] for card in deck], [PlayerState(hand) for hand in hands])
+            return
+
         # Put all card in deck except E.K. and 2 defuse cards        
         deck = [Cards.DEFUSE] * self.game_config["num_defuse_cards"] \
             + [Cards.ATTACK] * self.game_config["num_attack_cards"] \
@@ -88,8 +113,8 @@ class ExplodingKittensGame:
             player_state = PlayerState()
             for _ in range(self.game_config["num_cards_in_starting_hand"]):
                 card = deck.pop()
-                player_state.hand[card] += 1
-            player_state.hand[Cards.DEFUSE] += self.game_config["num_defuse_cards_in_starting_hand"]
+                player_state.hand[CARD_INDEX[card]] += 1
+            player_state.hand[DEFUSE_INDEX] += self.game_config["num_defuse_cards_in_starting_hand"]
 
             players.append(player_state)
 
@@ -115,11 +140,11 @@ class ExplodingKittensGame:
         logger.info('CARD DRAWN WAS: ' + card.value)
         if card == Cards.EXPLODING_KITTEN:
             logger.info('BOMB WAS DRAWN')
-            if self.game_state.current_hand[Cards.DEFUSE] > 0:
+            if self.game_state.current_hand[DEFUSE_INDEX] > 0:
                 logger.info('PLAYER HAS DEFUSE')
 
                 # Has a defuse
-                self.game_state.current_hand[Cards.DEFUSE] -= 1
+                self.game_state.current_hand[DEFUSE_INDEX] -= 1
                 self.game_state.discard_pile.append(Cards.DEFUSE)
 
                 # Insert E.K. into deck randomly
@@ -145,7 +170,7 @@ class ExplodingKittensGame:
                 logger.info('WINNER: PLAYER ' + str(winner))
 
         else:
-            self.game_state.current_hand[card] += 1
+            self.game_state.current_hand[CARD_INDEX[card]] += 1
 
         # Go to next player
         self.game_state.current_player = self.game_state.next_player
@@ -164,9 +189,10 @@ class ExplodingKittensGame:
 
         # Get the card corresponding to the action
         card = card_type
+        card_index = CARD_INDEX[card]
 
         # Take the card out of the hand
-        self.game_state.current_hand[card_type] -= 1
+        self.game_state.current_hand[card_index] -= 1
         self.game_state.discard_pile.append(card)
 
         # Logic depending on which card was played
@@ -190,37 +216,29 @@ class ExplodingKittensGame:
             random.shuffle(self.game_state.deck)
 
         elif card == Cards.FAVOR:
-            # If no opponent was selected or selected opponent has no cards, choose opponent at random
-            if opponent_selected is None or sum(self.game_state.player_states[opponent_selected].hand.values()) == 0:
-                opponents = [i for i in range(self.game_state.num_players) if i != self.game_state.current_player and sum(self.game_state.player_states[i].hand.values()) > 0 and not self.game_state.player_states[i].is_out]
-                opponent_selected = np.random.choice(opponents)
-            assert opponent_selected != self.game_state.current_player and opponent_selected in range(self.game_state.num_players)
-
-            chosen_card = random.choices(list(self.game_state.player_states[opponent_selected].hand.keys()), self.game_state.player_states[opponent_selected].hand.values())[0]
-            
-            logger.info('PLAYER SELECTED: PLAYER ' + str(opponent_selected))
-            logger.info('PLAYER RANDOMLY CHOSE CARD: ' + str(chosen_card))
-
-            self.game_state.current_hand[chosen_card] += 1
-            self.game_state.player_states[opponent_selected].hand[chosen_card] -= 1
+            self.steal_card(opponent_selected)
 
         elif is_cat_card(card):
-            self.game_state.current_hand[card] -= 1
+            self.game_state.current_hand[card_index] -= 1
             self.game_state.discard_pile.append(card)
 
-            # If no opponent was selected or selected opponent has no cards, choose opponent at random
-            if opponent_selected is None or sum(self.game_state.player_states[opponent_selected].hand.values()) == 0:
-                opponents = [i for i in range(self.game_state.num_players) if i != self.game_state.current_player and sum(self.game_state.player_states[i].hand.values()) > 0 and not self.game_state.player_states[i].is_out]
-                opponent_selected = np.random.choice(opponents)
-            assert opponent_selected != self.game_state.current_player and opponent_selected in range(self.game_state.num_players)
+            self.steal_card(opponent_selected)
 
-            chosen_card = random.choices(list(self.game_state.player_states[opponent_selected].hand.keys()), self.game_state.player_states[opponent_selected].hand.values())[0]
-            
-            logger.info('PLAYER SELECTED: PLAYER ' + str(opponent_selected))
-            logger.info('PLAYER RANDOMLY CHOSE CARD: ' + str(chosen_card))
+    def steal_card(self, opponent_selected=None) -> None:
+        # If no opponent was selected or selected opponent has no cards, choose opponent at random
+        if opponent_selected is None or sum(self.game_state.player_states[opponent_selected].hand) == 0:
+            opponents = [i for i in range(self.game_state.num_players) if i != self.game_state.current_player and sum(self.game_state.player_states[i].hand) > 0 and not self.game_state.player_states[i].is_out]
+            opponent_selected = np.random.choice(opponents)
+        assert opponent_selected != self.game_state.current_player and opponent_selected in range(self.game_state.num_players)
+
+        opponent_hand = self.game_state.player_states[opponent_selected].hand
+        chosen_index = random.choices(range(len(opponent_hand)), opponent_hand)[0]
 
-            self.game_state.current_hand[chosen_card] += 1
-            self.game_state.player_states[opponent_selected].hand[chosen_card] -= 1
+        logger.info('PLAYER SELECTED: PLAYER ' + str(opponent_selected))
+        logger.info('PLAYER RANDOMLY CHOSE CARD: ' + str(HAND_CARDS[chosen_index]))
+
+        self.game_state.current_hand[chosen_index] += 1
+        opponent_hand[chosen_index] -= 1
 
 
 @dataclass
@@ -238,7 +256,7 @@ class ExplodingKittensGameState:
         return len(self.deck) == 0 or sum([p.is_out for p in self.player_states]) == self.num_players - 1
 
     @property
-    def current_hand(self) -> dict[Cards, int]:
+    def current_hand(self) -> list[int]:
         return self.player_states[self.current_player].hand
         
     @property
@@ -266,45 +284,47 @@ class ExplodingKittensGameState:
 
         _playable_card_types = set()
 
-        for card_type, num_cards_of_type in self.current_hand.items(): 
+        for card_index, num_cards_of_type in enumerate(self.current_hand): 
             
             if num_cards_of_type == 0:
                 # If no cards of this type are the hand, this card acannot be played
                 continue  
+
+            card_type = HAND_CARDS[card_index]
           
-            if card_type == Cards.DEFUSE:
+            if card_index == DEFUSE_INDEX:
                 # TODO This action signifies playing a defuse card. Disallow for now, but we can potentially
                 # have the agent learn that they should never play this card to show that the agent
                 # is learning something
                 continue
            
-            elif card_type == Cards.ATTACK:
+            elif card_index == ATTACK_INDEX:
                 # To simplify, disallow playing an attack card the first turn after
                 # one has just been played
                 # if self.last_played_card != Cards.ATTACK:
                 #     _playable_card_types.add(card_type)
                 _playable_card_types.add(card_type)
             
-            elif card_type == Cards.SHUFFLE:
+            elif card_index == SHUFFLE_INDEX:
                 # Can always play a shuffle card
                 _playable_card_types.add(card_type)
             
-            elif card_type == Cards.SKIP:
+            elif card_index == SKIP_INDEX:
                 # Can always play a skip card
                 _playable_card_types.add(card_type)
             
-            elif card_type == Cards.FAVOR:
+            elif card_index == FAVOR_INDEX:
                 # Favor card requires at least one opponent to have a card in their hand
                 for playerId, player_state in enumerate(self.player_states):
-                    if playerId != self.current_player and sum(player_state.hand.values()) > 0 and player_state.is_out == False:
+                    if playerId != self.current_player and sum(player_state.hand) > 0 and player_state.is_out == False:
                         _playable_card_types.add(card_type)
                         break
             
-            elif is_cat_card(card_type):
+            elif card_index in CAT_INDICES:
                 # Game rules dictate there must be 2 of a kind to play a 'CAT' card
                 if num_cards_of_type >= 2:
                     for playerId, player_state in enumerate(self.player_states):
-                        if playerId != self.current_player and sum(player_state.hand.values()) > 0:
+                        if playerId != self.current_player and sum(player_state.hand) > 0:
                             _playable_card_types.add(card_type)
                             break
 
@@ -342,11 +362,11 @@ class ExplodingKittensGameState:
 
 def test(ekgs):
     card = Cards.DEFUSE
-    _ = ekgs.player_states[0].hand[card]
-    _ = ekgs.player_states[0].hand['DEFUSE']
+    _ = ekgs.player_states[0].hand[CARD_INDEX[card]]
+    _ = ekgs.player_states[0].hand[CARD_INDEX['DEFUSE']]
 
 def test_json(ekg):
-    json.dumps(asdict(ekg.game_state))
+    json.dumps(game_state_dict(ekg.game_state))
 
 if __name__ == "__main__":
     import pprint
@@ -363,14 +383,14 @@ if __name__ == "__main__":
 
     ekg = ExplodingKittensGame('game_config_very_small.json')
 
-    pprint.pp(asdict(ekg.game_state), indent=0)
+    pprint.pp(game_state_dict(ekg.game_state), indent=0)
 
     # logger.debug()
 
     ekg.play_card(Cards.ATTACK)
     ekg.draw_card()
 
-    pprint.pp(asdict(ekg.game_state), indent=0)
+    pprint.pp(game_state_dict(ekg.game_state), indent=0)
 
     pprint.pp(ekg.game_state.playable_card_types)
 
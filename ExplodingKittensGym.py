@@ -1,19 +1,29 @@
 from dataclasses import asdict
 from typing import Any
 import logging
+import random
 
 import numpy as np
 import gymnasium as gym
 from gymnasium import spaces
 
 from ExplodingKittensGame import ExplodingKittensGame, ExplodingKittensGameState, Cards
+from ExplodingKittensBatchGame import deal_stream
+
+import config
 
 MAX_CARDS_PER_TYPE = 10
 
+def _deal_stream(game_config, seed):
+    # initial deals for reset, or None to deal each game card by card
+    if not config.DEAL_BATCH_SIZE:
+        return None
+    return deal_stream(game_config, config.DEAL_BATCH_SIZE, seed)
+
 def _get_total_num_cards(game_state: ExplodingKittensGameState) -> int:
     return len(game_state.deck) \
         + len(game_state.discard_pile) \
-        + sum([sum(player_state.hand.values()) for player_state in game_state.player_states])
+        + sum([sum(player_state.hand) for player_state in game_state.player_states])
 
 class ExplodingKittensGym(gym.Env):
     def __init__(self):
@@ -22,6 +32,7 @@ class ExplodingKittensGym(gym.Env):
         self.logger = logging.getLogger(__name__)
         
         self.game = ExplodingKittensGame("game_config_very_small.json")
+        self.game.deals = _deal_stream(self.game.game_config, random.getrandbits(64))
 
         self.total_num_cards = _get_total_num_cards(self.game.game_state)
 
@@ -52,7 +63,9 @@ class ExplodingKittensGym(gym.Env):
     def reset(self, seed: Any = None):
         self.seed = seed
 
-        self.game = ExplodingKittensGame("game_config_very_small.json")
+        if seed is not None:
+            self.game.deals = _deal_stream(self.game.game_config, seed)
+        self.game.reset()
 
         info = {}
 
@@ -100,8 +113,8 @@ class ExplodingKittensGym(gym.Env):
 
         _game_state['play_direction'] = 0 if _game_state['play_direction'] == 'left' else 1
 
-        _game_state['player_0_hand'] = np.array(list(_game_state['player_states'][0]['hand'].values()))
-        _game_state['player_1_hand'] = np.array(list(_game_state['player_states'][1]['hand'].values()))
+        _game_state['player_0_hand'] = np.array(_game_state['player_states'][0]['hand'])
+        _game_state['player_1_hand'] = np.array(_game_state['player_states'][1]['hand'])
 
         _game_state['player_0_is_out'] = int(_game_state['player_states'][0]['is_out'])
         _game_state['player_1_is_out'] = int(_game_state['player_states'][1]['is_out'])
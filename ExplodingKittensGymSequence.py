@@ -1,19 +1,30 @@
 from dataclasses import asdict
 from typing import Any
+import random
 
 import numpy as np
 import gymnasium as gym
 from gymnasium import spaces
 
 from ExplodingKittensGame import ExplodingKittensGame, Cards
+from ExplodingKittensBatchGame import deal_stream
+
+import config
 
 MAX_CARDS_PER_TYPE = 10
 
+def _deal_stream(game_config, seed):
+    # initial deals for reset, or None to deal each game card by card
+    if not config.DEAL_BATCH_SIZE:
+        return None
+    return deal_stream(game_config, config.DEAL_BATCH_SIZE, seed)
+
 class ExplodingKittensGym(gym.Env):
     def __init__(self):
         super().__init__()
         
         self.game = ExplodingKittensGame("game_config_very_small.json")
+        self.game.deals = _deal_stream(self.game.game_config, random.getrandbits(64))
 
         self.card_to_int_mapping = {
             card: i for i, card in enumerate(Cards)
@@ -48,7 +59,9 @@ class ExplodingKittensGym(gym.Env):
 
     def reset(self, seed: Any = None):
         self.seed = seed
-        self.game = ExplodingKittensGame("game_config_very_small.json")
+        if seed is not None:
+            self.game.deals = _deal_stream(self.game.game_config, seed)
+        self.game.reset()
 
         info = {}
 
@@ -80,7 +93,7 @@ class ExplodingKittensGym(gym.Env):
         _game_state['play_direction'] = 0 if _game_state['play_direction'] == 'left' else 1
 
         _game_state['player_hands'] = np.array(
-            [list(player_state['hand'].values()) for player_state in _game_state['player_states']]
+            [player_state['hand'] for player_state in _game_state['player_states']]
         )
 
         _game_state['player_is_out'] = np.array(
@@ -135,8 +135,8 @@ class ExplodingKittensSinglePlayerGym(ExplodingKittensGym):
 
         opponent_number = 1 - self.player_number
 
-        _game_state['player_hand'] = np.array(list(_game_state['player_states'][self.player_number]['hand'].values()))
-        _game_state['opponent_hand'] = np.array(list(_game_state['player_states'][opponent_number]['hand'].values()))
+        _game_state['player_hand'] = np.array(_game_state['player_states'][self.player_number]['hand'])
+        _game_state['opponent_hand'] = np.array(_game_state['player_states'][opponent_number]['hand'])
 
         _game_state['player_is_out'] = int(_game_state['player_states'][self.player_number]['is_out'])
         _game_state['opponent_is_out'] = int(_game_state['player_states'][opponent_number]['is_out'])
@@ -1,18 +1,155 @@
 import numpy as np
 import logging
+import math
+import time
+from collections import Counter
 import config
+from game import Cards
 
 from utils import setup_logger
 import loggers as lg
 
 
+def selectPUCT(Q, N, P, visits, cpuct, isRoot, available=None):
+    # Index of the edge maximising Q + U, computed for the node's whole edge
+    # block in one numpy expression. At the root the prior is mixed with
+    # Dirichlet noise first. `available` masks out edges that cannot be taken.
+    if isRoot:
+        nu = np.random.dirichlet([config.ALPHA] * len(P))
+        P = (1 - config.EPSILON) * P + config.EPSILON * nu
+
+    scores = Q + (cpuct * math.sqrt(visits)) * P / (N + 1.0)
+    if available is not None:
+        scores = np.where(available, scores, -np.inf)
+    return int(np.argmax(scores))
+
+
+def gumbelSigma(Q, N):
+    # Monotone transform of root Q values (in [-1, 1]) onto the scale of the
+    # prior logits, growing with the most visited edge's count (Gumbel MuZero)
+    return (config.GUMBEL_C_VISIT + N.max()) * config.GUMBEL_C_SCALE * (Q + 1) / 2
+
+
+def improvedPolicy(P, N, Q, rootValue):
+    # softmax(log P + sigma(completed Q)) over the root edges. Unvisited edges
+    # get the mixed value: the root's own value estimate averaged with the
+    # prior-weighted Q of the visited edges.
+    visited = N > 0
+    completedQ = np.full(len(P), rootValue, dtype=np.float64)
+    if visited.any():
+        weighted = (P[visited] * Q[visited]).sum() / P[visited].sum()
+        completedQ[:] = (rootValue + N.sum() * weighted) / (1 + N.sum())
+        completedQ[visited] = Q[visited]
+
+    logits = np.log(np.maximum(P, 1e-12)) + gumbelSigma(completedQ, N)
+    policy = np.exp(logits - logits.max())
+    return policy / policy.sum()
+
+
+class SearchStats():
+    # Opt-in counters and cumulative timers for one search (MCTS_STATS). The
+    # phases are timed separately: select is the tree walk excluding the
+    # takeAction calls made during it, evaluate is model prediction including
+    # input encoding, expand and backup the tree updates.
+    PHASES = ('select', 'takeAction', 'evaluate', 'expand', 'backup')
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(self.PHASES, 0.0)
+        self.calls = dict.fromkeys(self.PHASES, 0)
+        self.simulations = 0
+        self.depths = Counter()
+        self.start = time.perf_counter()
+
+    def lap(self, phase, start):
+        # add the time since `start` to `phase` and return the current time
+        now = time.perf_counter()
+        self.seconds[phase] += now - start
+        self.calls[phase] += 1
+        return now
+
+    def record(self, mcts):
+        # the search summary as a plain dict, e.g. for one line of a JSON log
+        elapsed = time.perf_counter() - self.start
+        seconds = dict(self.seconds)
+        seconds['select'] -= seconds['takeAction']
+        return {
+            'simulations': self.simulations,
+            'seconds': elapsed,
+            'simulationsPerSecond': self.simulations / elapsed if elapsed > 0 else 0.0,
+            'phaseSeconds': seconds,
+            'phaseCalls': dict(self.calls),
+            'treeSize': len(mcts),
+            'peakTreeSize': mcts.peakNodes,
+            'depthHistogram': {int(depth): count for depth, count in sorted(self.depths.items())},
+            'branchingFactor': mcts.branchingFactor(),
+        }
+
+
+class ChanceNode():
+    # The random outcomes of taking one edge's action (GameState.chanceOutcomes),
+    # how many traversals of the edge went to each and the node each led to.
+    # Deterministic actions get a single outcome of None. `exact` says the
+    # outcomes are everything the action can lead to rather than a sample, so
+    # the solver may prove the edge from its children.
+
+    def __init__(self, outcomes, exact=True):
+        self.probs = np.array([prob for prob, _ in outcomes])
+        self.outcomes = [outcome for _, outcome in outcomes]
+        self.counts = np.zeros(len(outcomes), dtype=np.int32)
+        self.children = [None] * len(outcomes)
+        self.exact = exact
+
+    def select(self):
+        # Index of the outcome whose share of traversals lags its probability
+        # the most, so visits split over the outcomes in proportion to their
+        # probabilities instead of by sampling.
+        if len(self.outcomes) == 1:
+            return 0
+        idx = int(np.argmax(self.probs * (self.counts.sum() + 1) - self.counts))
+        self.counts[idx] += 1
+        return idx
+
+
+def chanceNode(state, action):
+    # With MCTS_CHANCE_NODES off every traversal lets takeAction draw its own
+    # random events, as the search originally did, and only deterministic
+    # actions are exact. Exactness only matters to the solver, so it is not
+    # worked out without it. Sampled shuffle orders are never exact.
+    if not config.MCTS_CHANCE_NODES:
+        return ChanceNode([(1.0, None)], bool(config.MCTS_SOLVER) and state.isDeterministic(action))
+    outcomes = state.chanceOutcomes(action, config.MCTS_SHUFFLE_SAMPLES)
+    return ChanceNode(outcomes or [(1.0, None)], Cards(action) != Cards.SHUFFLE)
+
+
+def combineProofs(proofs):
+    # Proof of an edge from the proofs of the children its outcomes led to,
+    # each from the edge player's point of view: a win or loss only if every
+    # outcome is that same proven result, otherwise 0
+    if not proofs or proofs[0] == 0 or any(proof != proofs[0] for proof in proofs):
+        return 0
+    return proofs[0]
+
+
 class Node():
 
-    def __init__(self, state):
+    def __init__(self, state, key=None):
         self.state = state
         self.playerTurn = state.playerTurn
-        self.id = state.id
+        self.id = state.hash if key is None else key
         self.edges = []
+        self.parent = None  # node this one was first reached from
+        self.parentIdx = None  # slot of the parent's edge it was reached through
+        # solver result for the player to move: 1 proven win, -1 proven loss
+        self.proven = 0
+
+        # Statistics of the edges leaving this node, one contiguous array per
+        # stat (edges[i] is slot i). Filled in by MCTS.expand.
+        self.visits = 0
+        self.N = None
+        self.W = None
+        self.Q = None
+        self.P = None
+        self.edgeProven = None  # solver result per edge, for this node's player
 
     def isLeaf(self):
         if len(self.edges) > 0:
@@ -21,21 +158,35 @@ class Node():
             return True
 
 
+class EdgeStats():
+    # dict-style view of one edge's slot in its node's N/W/Q/P arrays
+
+    def __init__(self, node, idx):
+        self.node = node
+        self.idx = idx
+
+    def __getitem__(self, key):
+        return getattr(self.node, key)[self.idx]
+
+    def __setitem__(self, key, value):
+        getattr(self.node, key)[self.idx] = value
+
+
 class Edge():
 
-    def __init__(self, inNode, prior, action):
-        self.id = inNode.state.id + '|' + str(action)
+    def __init__(self, inNode, action, idx):
         self.inNode = inNode
-        # self.outNodes = []
+        self.outNodes = set()  # every node taking the edge has led to
         self.playerTurn = inNode.state.playerTurn
         self.action = action
+        self.idx = idx
+        self.chance = None  # ChanceNode, built the first time the edge is taken
 
-        self.stats = {
-            'N': 0,
-            'W': 0,
-            'Q': 0,
-            'P': prior,
-        }
+        self.stats = EdgeStats(inNode, idx)
+
+    @property
+    def id(self):
+        return self.inNode.state.id + '|' + str(self.action)
 
 
 class MCTS():
@@ -44,12 +195,17 @@ class MCTS():
         self.root = root
         self.tree = {}
         self.cpuct = cpuct
+        self.nodesFreed = 0
+        self.peakNodes = 0
+        self.stats = None  # SearchStats, set by the agent while it searches
         self.addNode(root)
 
     def __len__(self):
         return len(self.tree)
 
-    def moveToLeaf(self):
+    def moveToLeaf(self, rootEdge=None):
+        # rootEdge, if given, is the index of the root edge to take instead of
+        # the PUCT choice
 
         # lg.logger_mcts.info('------MOVING TO LEAF------')
 
@@ -59,73 +215,60 @@ class MCTS():
         done = 0
         value = 0
 
-        while not currentNode.isLeaf():
+        while not currentNode.isLeaf() and currentNode.proven == 0:
 
             # lg.logger_mcts.info('PLAYER TURN...%d',
             #                     currentNode.state.playerTurn)
 
-            maxQU = -99999
-
-            if currentNode == self.root:
-                epsilon = config.EPSILON
-                nu = np.random.dirichlet(
-                    [config.ALPHA] * len(currentNode.edges))
+            if currentNode == self.root and rootEdge is not None:
+                idx = rootEdge
             else:
-                epsilon = 0
-                nu = [0] * len(currentNode.edges)
-
-            Nb = 0
-            for action, edge in currentNode.edges:
-                Nb = Nb + edge.stats['N']
-
-            for idx, (action, edge) in enumerate(currentNode.edges):
-
-                U = self.cpuct * \
-                    ((1-epsilon) * edge.stats['P'] + epsilon * nu[idx]) * \
-                    np.sqrt(Nb) / (1 + edge.stats['N'])
-
-                Q = edge.stats['Q']
-
-                # lg.logger_mcts.info('action: %d (%d)... N = %d, P = %f, nu = %f, adjP = %f, W = %f, Q = %f, U = %f, Q+U = %f', action, action % 7, edge.stats['N'], np.round(
-                #     edge.stats['P'], 6), np.round(nu[idx], 6), ((1-epsilon) * edge.stats['P'] + epsilon * nu[idx]), np.round(edge.stats['W'], 6), np.round(Q, 6), np.round(U, 6), np.round(Q+U, 6))
-
-                if Q + U > maxQU:
-                    maxQU = Q + U
-                    simulationAction = action
-                    simulationEdge = edge
+                # edges proven lost are never taken
+                available = currentNode.edgeProven >= 0 \
+                    if currentNode.edgeProven.any() else None
+                idx = selectPUCT(currentNode.Q, currentNode.N, currentNode.P,
+                                 currentNode.visits, self.cpuct,
+                                 currentNode == self.root, available)
+            simulationAction, simulationEdge = currentNode.edges[idx]
 
             # lg.logger_mcts.info(
             #     'action with highest Q + U...%d', simulationAction)
             # lg.logger_mcts.info(
             #     'current state/id...%s', currentNode.state.id)
             # the value of the newState from the POV of the new playerTurn
+            chance = simulationEdge.chance
+            if chance is None:
+                chance = simulationEdge.chance = chanceNode(currentNode.state, simulationAction)
+            outcome = chance.select()
+            if self.stats is not None:
+                start = time.perf_counter()
             newState, value, done, _, _ = currentNode.state.takeAction(
-                simulationAction)
+                simulationAction, chance.outcomes[outcome])
+            if self.stats is not None:
+                self.stats.lap('takeAction', start)
 
-            if newState.id not in self.tree:
+            if newState.hash not in self.tree:
                 newNode = Node(newState)
+                newNode.parent = currentNode
+                newNode.parentIdx = idx
+                if done and config.MCTS_SOLVER:
+                    newNode.proven = value
                 self.addNode(newNode)
             else:
-                newNode = self.tree[newState.id]
-
-            # Possibly don't even need this
-            # if newNode not in simulationEdge.outNodes:
-            #     simulationEdge.outNodes.append(newNode)
-
-            # endGame = 1 if newNode.state.isEndGame else 0
-            # if done != endGame:
-            #     print("done", done, "newNode.state.isEndGame",
-            #           newNode.state.isEndGame)
-            #     inTree = newState.id not in self.tree
-            #     print("inTree:", inTree)
-            #     print("newState id", newState.id)
-            #     print("newNode id", newNode.state.id)
+                newNode = self.tree[newState.hash]
+            chance.children[outcome] = newNode
+            simulationEdge.outNodes.add(newNode)
 
             currentNode = newNode
             breadcrumbs.append(simulationEdge)
 
         # lg.logger_mcts.info('DONE...%d', done)
 
+        if currentNode.proven != 0:
+            # a solved node is scored like a terminal one
+            value = currentNode.proven
+            done = 1
+
         return currentNode, value, done, breadcrumbs
 
     def backFill(self, leaf, value, breadcrumbs):
@@ -140,14 +283,533 @@ class MCTS():
             else:
                 direction = -1
 
-            edge.stats['N'] = edge.stats['N'] + 1
-            edge.stats['W'] = edge.stats['W'] + value * direction
-            edge.stats['Q'] = edge.stats['W'] / edge.stats['N']
+            node = edge.inNode
+            idx = edge.idx
+            node.visits = node.visits + 1
+            node.N[idx] = node.N[idx] + 1
+            node.W[idx] = node.W[idx] + value * direction
+            node.Q[idx] = node.W[idx] / node.N[idx]
 
             # lg.logger_mcts.info('updating edge with value %f for player %d... N = %d, W = %f, Q = %f', value * direction, playerTurn, edge.stats['N'], edge.stats['W'], edge.stats['Q']
             #                     )
 
             # edge.outNode.state.render(lg.logger_mcts)
 
+        if leaf.proven != 0:
+            self._propagateProof(breadcrumbs)
+
+    def _propagateProof(self, breadcrumbs):
+        # Walk back up a path that ended in a solved node, re-proving each edge
+        # from its children. A node is won once one of its edges is won and
+        # lost once all of them are lost; the walk stops at the first node
+        # that stays unsolved.
+        for edge in reversed(breadcrumbs):
+            node = edge.inNode
+            chance = edge.chance
+            if chance is None or not chance.exact or None in chance.children:
+                return
+            node.edgeProven[edge.idx] = combineProofs(
+                [child.proven if child.playerTurn == node.playerTurn else -child.proven
+                 for child in chance.children])
+            if node.edgeProven[edge.idx] == 1:
+                node.proven = 1
+            elif (node.edgeProven == -1).all():
+                node.proven = -1
+            else:
+                return
+
+    def keyOf(self, state):
+        # key of the node for `state` in self.tree
+        return state.hash
+
     def addNode(self, node):
         self.tree[node.id] = node
+        if len(self.tree) > self.peakNodes:
+            self.peakNodes = len(self.tree)
+
+    def _removeNodes(self, nodes):
+        for node in nodes:
+            del self.tree[node.id]
+        self.nodesFreed += len(nodes)
+
+    def changeRoot(self, key):
+        # Move the root and drop every node that can no longer be reached from
+        # it by following edges. Transpositions mean a node can still be
+        # reachable after the node it was first reached from is dropped; its
+        # parent link then moves to a node it is reachable through.
+        self.root = self.tree[key]
+        self.root.parent = None
+        self.root.parentIdx = None
+
+        reachedFrom = {self.root.id: (None, None)}
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            for _, edge in node.edges:
+                # evicted nodes are left out
+                edge.outNodes = {child for child in edge.outNodes
+                                 if self.tree.get(child.id) is child}
+                for child in edge.outNodes:
+                    if child.id not in reachedFrom:
+                        reachedFrom[child.id] = (node, edge.idx)
+                        stack.append(child)
+
+        self._removeNodes([node for key, node in self.tree.items() if key not in reachedFrom])
+        for key, node in self.tree.items():
+            if node.parent is not None and node.parent.id not in reachedFrom:
+                node.parent, node.parentIdx = reachedFrom[key]
+
+    def enforceNodeCap(self, maxNodes):
+        # Once the tree holds more than maxNodes nodes, evict the unexpanded
+        # leaves behind the least taken edges until it is back down to 90% of
+        # the cap, or no such leaves are left. Expanded nodes are kept, as
+        # their edge statistics would cost a network evaluation and the
+        # search through them to rebuild. maxNodes = 0 means no cap.
+        if not maxNodes or len(self.tree) <= maxNodes:
+            return
+        target = int(maxNodes * 0.9)
+        leaves = [node for node in self.tree.values()
+                  if node.isLeaf() and node is not self.root]
+        leaves.sort(key=lambda node: node.parent.N[node.parentIdx]
+                    if node.parentIdx is not None else 0)
+        self._removeNodes(leaves[:len(self.tree) - target])
+
+    def virtualLoss(self, breadcrumbs, loss):
+        # Count each edge on the path as `loss` extra visits lost by the player
+        # taking it; call again with -loss to undo.
+        for edge in breadcrumbs:
+            node = edge.inNode
+            idx = edge.idx
+            node.visits = node.visits + loss
+            node.N[idx] = node.N[idx] + loss
+            node.W[idx] = node.W[idx] - loss
+            node.Q[idx] = node.W[idx] / node.N[idx] if node.N[idx] > 0 else 0
+
+    def expand(self, leaf, allowedActions, probs):
+        if not leaf.isLeaf():
+            return
+        n = len(allowedActions)
+        leaf.N = np.zeros(n, dtype=np.int32)
+        leaf.W = np.zeros(n, dtype=np.float32)
+        leaf.Q = np.zeros(n, dtype=np.float32)
+        leaf.P = np.array(probs, dtype=np.float32)
+        leaf.edgeProven = np.zeros(n, dtype=np.int8)
+        leaf.edges = [(action, Edge(leaf, action, idx))
+                      for idx, action in enumerate(allowedActions)]
+
+    def stateOf(self, node):
+        return node.state
+
+    def branchingFactor(self):
+        # mean number of edges of the expanded nodes
+        counts = [len(node.edges) for node in self.tree.values() if not node.isLeaf()]
+        return float(np.mean(counts)) if counts else 0.0
+
+    def rootStats(self):
+        # (actions, N, Q) of the edges leaving the root
+        if self.root.isLeaf():
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=np.float32)
+        actions = np.array([action for action, _ in self.root.edges], dtype=int)
+        return actions, self.root.N.copy(), self.root.Q.copy()
+
+    def rootPrior(self):
+        # P of the edges leaving the root, in rootStats order
+        if self.root.isLeaf():
+            return np.zeros(0, dtype=np.float32)
+        return self.root.P.copy()
+
+    def rootProof(self):
+        # solver result of the edges leaving the root, in rootStats order
+        if self.root.isLeaf():
+            return np.zeros(0, dtype=np.int8)
+        return self.root.edgeProven.copy()
+
+
+class ISMCTS(MCTS):
+    # Single-observer information-set MCTS. Nodes are keyed on the
+    # infoSetHash of the player the tree searches for (the root's player to
+    # move), so all the deck orders and opponent hands that player cannot tell
+    # apart share one node. Each simulation walks the tree with a fresh
+    # determinization of the root and lets actions draw their own random
+    # events (chance nodes are not used). The determinization is private to
+    # the walk, so it is moved along in place with GameState.apply and only
+    # copied when a new node needs a state. A node's state is the first
+    # determinization that reached it; at the opponent's nodes its edges are
+    # that determinization's allowed actions, and later walks pick among the
+    # ones their own determinization allows.
+
+    def __init__(self, root, cpuct):
+        self.observer = root.state.playerTurn
+        super().__init__(root, cpuct)
+
+    def keyOf(self, state):
+        # states the observer is not to move in cannot become the root
+        if state.playerTurn != self.observer:
+            return None
+        return state.infoSetHash(self.observer)
+
+    def moveToLeaf(self, rootEdge=None):
+        breadcrumbs = []
+        currentNode = self.root
+        state = self.root.state.determinize(self.observer)
+
+        done = 0
+        value = 0
+
+        while not currentNode.isLeaf():
+            available = None
+            if state.playerTurn != self.observer:
+                available = np.isin(currentNode.actions, state.allowedActions)
+            if currentNode == self.root and rootEdge is not None:
+                idx = rootEdge
+            else:
+                idx = selectPUCT(currentNode.Q, currentNode.N, currentNode.P,
+                                 currentNode.visits, self.cpuct,
+                                 currentNode == self.root, available)
+            simulationAction, simulationEdge = currentNode.edges[idx]
+
+            if self.stats is not None:
+                start = time.perf_counter()
+            move = state.apply(simulationAction)
+            value, done = move.value, move.done
+            if self.stats is not None:
+                self.stats.lap('takeAction', start)
+
+            key = state.infoSetHash(self.observer)
+            if key not in self.tree:
+                newNode = Node(state.copy(), key)
+                newNode.parent = currentNode
+                newNode.parentIdx = idx
+                self.addNode(newNode)
+            else:
+                newNode = self.tree[key]
+            simulationEdge.outNodes.add(newNode)
+
+            currentNode = newNode
+            breadcrumbs.append(simulationEdge)
+
+        return currentNode, value, done, breadcrumbs
+
+    def expand(self, leaf, allowedActions, probs):
+        super().expand(leaf, allowedActions, probs)
+        leaf.actions = np.array([action for action, _ in leaf.edges])
+
+
+class ArrayMCTS():
+    # Same search as MCTS, but the tree is stored as a struct-of-arrays: node and
+    # edge statistics live in preallocated numpy arrays indexed by integer ids
+    # (grown by doubling) instead of one Node/Edge object per entry.
+    #
+    # Nodes:  playerTurn, visits (sum of N over the node's edges), parent (edge
+    #         the node was first reached through, -1 for the root), firstEdge /
+    #         numEdges (the node's edges are the contiguous block
+    #         [firstEdge, firstEdge + numEdges)), proven (solver result)
+    # Edges:  N, W, Q, P, action, edgeNode (node the edge leaves from),
+    #         child (node the edge last led to), edgeProven (solver result)
+    #
+    # Chance nodes are kept in a dict from edge id, as there are few of them;
+    # their children are node ids. So are links, the nodes an edge led to
+    # other than those first reached through it (transpositions and further
+    # random outcomes), as sets of node ids.
+    #
+    # tree maps state hash -> node id, so Agent.act / changeRootMCTS work as for MCTS.
+
+    def __init__(self, root, cpuct, capacity=1024):
+        self.cpuct = cpuct
+        self.tree = {}
+        self.states = []
+        self.chance = {}
+        self.links = {}
+        self.nodesFreed = 0
+        self.peakNodes = 0
+        self.stats = None
+
+        self.numNodes = 0
+        self.playerTurn = np.zeros(capacity, dtype=np.int8)
+        self.visits = np.zeros(capacity, dtype=np.int32)
+        self.parent = np.full(capacity, -1, dtype=np.int32)
+        self.firstEdge = np.full(capacity, -1, dtype=np.int32)
+        self.numEdges = np.zeros(capacity, dtype=np.int16)
+        self.proven = np.zeros(capacity, dtype=np.int8)
+
+        edgeCapacity = capacity * 4
+        self.numEdgesTotal = 0
+        self.N = np.zeros(edgeCapacity, dtype=np.int32)
+        self.W = np.zeros(edgeCapacity, dtype=np.float32)
+        self.Q = np.zeros(edgeCapacity, dtype=np.float32)
+        self.P = np.zeros(edgeCapacity, dtype=np.float32)
+        self.action = np.zeros(edgeCapacity, dtype=np.int8)
+        self.edgeNode = np.full(edgeCapacity, -1, dtype=np.int32)
+        self.child = np.full(edgeCapacity, -1, dtype=np.int32)
+        self.edgeProven = np.zeros(edgeCapacity, dtype=np.int8)
+
+        self.root = self.addNode(root)
+
+    def __len__(self):
+        return self.numNodes
+
+    def _grow(self, arrays, size, fill):
+        for name in arrays:
+            old = getattr(self, name)
+            new = np.full(max(size, 2 * len(old)), fill, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def keyOf(self, state):
+        return state.hash
+
+    def addNode(self, state, parentEdge=-1):
+        idx = self.numNodes
+        if idx == len(self.playerTurn):
+            self._grow(['playerTurn', 'visits', 'numEdges', 'proven'], idx + 1, 0)
+            self._grow(['parent', 'firstEdge'], idx + 1, -1)
+
+        self.playerTurn[idx] = state.playerTurn
+        self.parent[idx] = parentEdge
+        self.states.append(state)
+        self.tree[state.hash] = idx
+        self.numNodes += 1
+        if self.numNodes > self.peakNodes:
+            self.peakNodes = self.numNodes
+        return idx
+
+    def _parentNodes(self):
+        parent = self.parent[:self.numNodes]
+        return np.where(parent >= 0, self.edgeNode[np.maximum(parent, 0)], -1)
+
+    def _compact(self, keep):
+        # Rebuild the arrays holding only the nodes flagged in `keep` and their
+        # edge blocks, renumbering nodes and edges in their current order.
+        oldNodes = np.flatnonzero(keep)
+        newNode = np.full(self.numNodes, -1, dtype=np.int32)
+        newNode[oldNodes] = np.arange(len(oldNodes))
+
+        counts = self.numEdges[oldNodes].astype(np.intp)
+        starts = np.cumsum(counts) - counts
+        numEdges = int(counts.sum())
+        oldEdges = np.repeat(self.firstEdge[oldNodes] - starts, counts) + \
+            np.arange(numEdges)
+        newEdge = np.full(self.numEdgesTotal, -1, dtype=np.int32)
+        newEdge[oldEdges] = np.arange(numEdges)
+
+        def remap(ids, mapping):
+            return np.where(ids >= 0, mapping[np.maximum(ids, 0)], -1)
+
+        def refill(name, values, fill=0):
+            # the arrays keep their capacity; unused slots go back to defaults
+            array = getattr(self, name)
+            array[:len(values)] = values
+            array[len(values):] = fill
+
+        refill('playerTurn', self.playerTurn[oldNodes])
+        refill('visits', self.visits[oldNodes])
+        refill('parent', remap(self.parent[oldNodes], newEdge), -1)
+        refill('firstEdge', np.where(counts > 0, starts, -1), -1)
+        refill('numEdges', counts)
+        refill('proven', self.proven[oldNodes])
+        for name in ['N', 'W', 'Q', 'P', 'action', 'edgeProven']:
+            refill(name, getattr(self, name)[oldEdges])
+        refill('edgeNode', newNode[self.edgeNode[oldEdges]], -1)
+        refill('child', remap(self.child[oldEdges], newNode), -1)
+
+        self.chance = {int(newEdge[edge]): chance for edge, chance in self.chance.items()
+                       if newEdge[edge] >= 0}
+        for chance in self.chance.values():
+            chance.children = [int(newNode[child]) if child is not None and newNode[child] >= 0
+                               else None for child in chance.children]
+        links = {}
+        for edge, nodes in self.links.items():
+            nodes = {int(newNode[node]) for node in nodes if newNode[node] >= 0}
+            if newEdge[edge] >= 0 and nodes:
+                links[int(newEdge[edge])] = nodes
+        self.links = links
+        self.states = [self.states[i] for i in oldNodes]
+        self.tree = {state.hash: i for i, state in enumerate(self.states)}
+        self.root = int(newNode[self.root])
+        self.nodesFreed += self.numNodes - len(oldNodes)
+        self.numNodes = len(oldNodes)
+        self.numEdgesTotal = numEdges
+
+    def changeRoot(self, key):
+        # see MCTS.changeRoot
+        self.root = self.tree[key]
+        self.parent[self.root] = -1
+
+        parentNode = self._parentNodes()
+        hasParent = parentNode >= 0
+        linkEdge = np.array([edge for edge, nodes in self.links.items() for _ in nodes],
+                            dtype=np.intp)
+        linkNode = np.array([node for nodes in self.links.values() for node in nodes],
+                            dtype=np.intp)
+        linkFrom = self.edgeNode[linkEdge]
+        reachable = np.zeros(self.numNodes, dtype=bool)
+        reachable[self.root] = True
+        while True:
+            grown = reachable | (hasParent & reachable[np.maximum(parentNode, 0)])
+            grown[linkNode[reachable[linkFrom]]] = True
+            if grown.sum() == reachable.sum():
+                break
+            reachable = grown
+
+        # nodes kept only through a link are reparented to it
+        orphans = reachable & hasParent & ~reachable[np.maximum(parentNode, 0)]
+        for edge, node in zip(linkEdge, linkNode):
+            if orphans[node] and reachable[self.edgeNode[edge]]:
+                self.parent[node] = edge
+                orphans[node] = False
+
+        self._compact(reachable)
+
+    def enforceNodeCap(self, maxNodes):
+        # see MCTS.enforceNodeCap
+        if not maxNodes or self.numNodes <= maxNodes:
+            return
+        target = int(maxNodes * 0.9)
+        leaves = np.flatnonzero(self.numEdges[:self.numNodes] == 0)
+        leaves = leaves[leaves != self.root]
+        taken = self.N[np.maximum(self.parent[leaves], 0)]
+        keep = np.ones(self.numNodes, dtype=bool)
+        keep[leaves[np.argsort(taken, kind='stable')[:self.numNodes - target]]] = False
+
+        self._compact(keep)
+
+    def expand(self, leaf, allowedActions, probs):
+        if self.numEdges[leaf] > 0:
+            return
+        n = len(allowedActions)
+        first = self.numEdgesTotal
+        if first + n > len(self.N):
+            self._grow(['N', 'W', 'Q', 'P', 'action', 'edgeProven'], first + n, 0)
+            self._grow(['edgeNode', 'child'], first + n, -1)
+
+        self.P[first:first + n] = probs
+        self.action[first:first + n] = allowedActions
+        self.edgeNode[first:first + n] = leaf
+        self.firstEdge[leaf] = first
+        self.numEdges[leaf] = n
+        self.numEdgesTotal += n
+
+    def stateOf(self, node):
+        return self.states[node]
+
+    def moveToLeaf(self, rootEdge=None):
+        breadcrumbs = []
+        currentNode = self.root
+
+        done = 0
+        value = 0
+
+        while self.numEdges[currentNode] > 0 and self.proven[currentNode] == 0:
+            first = self.firstEdge[currentNode]
+            last = first + self.numEdges[currentNode]
+
+            if currentNode == self.root and rootEdge is not None:
+                simulationEdge = first + rootEdge
+            else:
+                edgeProven = self.edgeProven[first:last]
+                simulationEdge = first + selectPUCT(
+                    self.Q[first:last], self.N[first:last], self.P[first:last],
+                    self.visits[currentNode], self.cpuct, currentNode == self.root,
+                    edgeProven >= 0 if edgeProven.any() else None)
+
+            action = int(self.action[simulationEdge])
+            chance = self.chance.get(simulationEdge)
+            if chance is None:
+                chance = self.chance[simulationEdge] = chanceNode(
+                    self.states[currentNode], action)
+            outcome = chance.select()
+            if self.stats is not None:
+                start = time.perf_counter()
+            newState, value, done, _, _ = self.states[currentNode].takeAction(
+                action, chance.outcomes[outcome])
+            if self.stats is not None:
+                self.stats.lap('takeAction', start)
+
+            newNode = self.tree.get(newState.hash)
+            if newNode is None:
+                newNode = self.addNode(newState, simulationEdge)
+                if done and config.MCTS_SOLVER:
+                    self.proven[newNode] = value
+            elif self.parent[newNode] != simulationEdge:
+                self.links.setdefault(simulationEdge, set()).add(newNode)
+            self.child[simulationEdge] = newNode
+            chance.children[outcome] = newNode
+
+            currentNode = newNode
+            breadcrumbs.append(simulationEdge)
+
+        if self.proven[currentNode] != 0:
+            value = int(self.proven[currentNode])
+            done = 1
+
+        return currentNode, value, done, breadcrumbs
+
+    def backFill(self, leaf, value, breadcrumbs):
+        if not breadcrumbs:
+            return
+        edges = np.array(breadcrumbs, dtype=np.intp)
+
+        direction = np.where(
+            self.playerTurn[self.edgeNode[edges]] == self.playerTurn[leaf], 1, -1)
+
+        self.N[edges] += 1
+        self.visits[self.edgeNode[edges]] += 1
+        self.W[edges] += value * direction
+        self.Q[edges] = self.W[edges] / self.N[edges]
+
+        if self.proven[leaf] != 0:
+            self._propagateProof(breadcrumbs)
+
+    def _propagateProof(self, breadcrumbs):
+        # see MCTS._propagateProof
+        for edge in reversed(breadcrumbs):
+            node = self.edgeNode[edge]
+            chance = self.chance.get(edge)
+            if chance is None or not chance.exact or None in chance.children:
+                return
+            self.edgeProven[edge] = combineProofs(
+                [self.proven[child] * (1 if self.playerTurn[child] == self.playerTurn[node] else -1)
+                 for child in chance.children])
+            first = self.firstEdge[node]
+            if self.edgeProven[edge] == 1:
+                self.proven[node] = 1
+            elif (self.edgeProven[first:first + self.numEdges[node]] == -1).all():
+                self.proven[node] = -1
+            else:
+                return
+
+    def virtualLoss(self, breadcrumbs, loss):
+        # see MCTS.virtualLoss
+        if not breadcrumbs:
+            return
+        edges = np.array(breadcrumbs, dtype=np.intp)
+
+        self.visits[self.edgeNode[edges]] += loss
+        self.N[edges] += loss
+        self.W[edges] -= loss
+        N = self.N[edges]
+        self.Q[edges] = np.where(N > 0, self.W[edges] / np.maximum(N, 1), 0)
+
+    def branchingFactor(self):
+        counts = self.numEdges[:self.numNodes]
+        return float(counts[counts > 0].mean()) if (counts > 0).any() else 0.0
+
+    def rootStats(self):
+        first = self.firstEdge[self.root]
+        last = first + self.numEdges[self.root]
+        return (self.action[first:last].astype(int), self.N[first:last].copy(),
+                self.Q[first:last].copy())
+
+    def rootPrior(self):
+        first = self.firstEdge[self.root]
+        return self.P[first:first + self.numEdges[self.root]].copy()
+
+    def rootProof(self):
+        first = self.firstEdge[self.root]
+        return self.edgeProven[first:first + self.numEdges[self.root]].copy()
+
+    def nbytes(self):
+        # bytes held by the node/edge arrays (allocated capacity, not just used)
+        return sum(getattr(self, name).nbytes for name in
+                   ['playerTurn', 'visits', 'parent', 'firstEdge', 'numEdges', 'proven',
+                    'N', 'W', 'Q', 'P', 'action', 'edgeNode', 'child', 'edgeProven'])
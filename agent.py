@@ -1,9 +1,17 @@
 # %matplotlib inline
 
 import numpy as np
+import copy
+import math
 import random
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import MCTS as mc
+from inference import InferenceQueue, EvaluationCache
+from evaluator import RolloutEvaluator
+from snapshot import SnapshotLibrary
 from game import GameState
 from loss import softmax_cross_entropy_with_logits
 
@@ -16,6 +24,30 @@ from IPython import display
 import pylab as pl
 
 
+# models rebuilt inside root-parallel worker processes, by model class
+_workerModels = {}
+
+
+def _rootSearchWorker(args):
+    # Runs in a pool process: search `state` on an independent tree with its own
+    # RNG stream and return the root edge statistics.
+    modelClass, modelArgs, weights, state, action_size, simulations, cpuct, seed, \
+        timeBudget, nodeBudget = args
+
+    random.seed(seed)
+    np.random.seed(seed)
+
+    if modelClass not in _workerModels:
+        _workerModels[modelClass] = modelClass(*modelArgs)
+    model = _workerModels[modelClass]
+    model.set_weights(weights)
+
+    worker = Agent('worker', None, action_size, simulations, cpuct, model)
+    worker.buildMCTS(state)
+    worker.search(simulations, timeBudget, nodeBudget)
+    return worker.mcts.rootStats()
+
+
 class User():
     def __init__(self, name, state_size, action_size):
         self.name = name
@@ -30,9 +62,16 @@ class User():
         NN_value = None
         return (action, pi, value, NN_value)
 
+    def ponder(self, state):
+        pass
+
+    def stopPondering(self):
+        return 0
+
 
 class Agent():
-    def __init__(self, name, state_size, action_size, mcts_simulations, cpuct, model):
+    def __init__(self, name, state_size, action_size, mcts_simulations, cpuct, model,
+                 evaluator=None, server=None):
         self.name = name
 
         self.state_size = state_size
@@ -43,7 +82,32 @@ class Agent():
         self.MCTSsimulations = mcts_simulations
         self.model = model
 
+        # leaf evaluator (see evaluator.py) used instead of the model
+        if evaluator is None and config.MCTS_EVALUATOR == 'rollout':
+            evaluator = RolloutEvaluator(action_size)
+        self.evaluator = evaluator
+        # shared InferenceServer the model's predict calls go through, if any;
+        # it predicts on its own thread
+        self.server = server
+        if server is not None:
+            model.prepareThreads()
+
+        # stored trees that new trees are warm-started from (see snapshot.py)
+        self.snapshots = SnapshotLibrary(config.MCTS_SNAPSHOT_FILE) \
+            if config.MCTS_SNAPSHOT_FILE else None
+
         self.mcts = None
+        self.evalCache = EvaluationCache(config.EVAL_CACHE_SIZE)
+        # with MCTS_STATS on, the SearchStats of the current search and the
+        # records of the finished ones (one per act)
+        self.stats = None
+        self.searchRecords = []
+        self._pool = None
+        self._poolSize = 0
+        # background search between our moves, see ponder
+        self._ponderThread = None
+        self._ponderStop = None
+        self._ponderSimulations = 0
 
         self.train_overall_loss = []
         self.train_value_loss = []
@@ -52,42 +116,424 @@ class Agent():
         self.val_value_loss = []
         self.val_policy_loss = []
 
-    def simulate(self):
+    def simulate(self, rootEdge=None):
 
         # lg.logger_mcts.info('ROOT NODE...%s', self.mcts.root.state.id)
         # self.mcts.root.state.render(lg.logger_mcts)
         # lg.logger_mcts.info('CURRENT PLAYER...%d',
         #                     self.mcts.root.state.playerTurn)
 
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+
         # MOVE THE LEAF NODE
-        leaf, value, done, breadcrumbs = self.mcts.moveToLeaf()
+        leaf, value, done, breadcrumbs = self.mcts.moveToLeaf(rootEdge)
         # leaf.state.render(lg.logger_mcts)
+        if stats is not None:
+            self._walked(stats, start, breadcrumbs)
 
         # EVALUATE THE LEAF NODE
         value, breadcrumbs = self.evaluateLeaf(leaf, value, done, breadcrumbs)
 
+        if stats is not None:
+            start = time.perf_counter()
         # BACKFILL THE VALUE THROUGH THE TREE
         self.mcts.backFill(leaf, value, breadcrumbs)
-
-    def act(self, state, tau):
-
-        if self.mcts == None or state.id not in self.mcts.tree:
-            self.buildMCTS(state)
-        else:
-            self.changeRootMCTS(state)
-
-        # run the simulation
-        for sim in range(self.MCTSsimulations):
+        if stats is not None:
+            stats.lap('backup', start)
+
+    def _walked(self, stats, start, breadcrumbs):
+        # count one tree walk that started at `start`
+        stats.lap('select', start)
+        stats.simulations += 1
+        stats.depths[len(breadcrumbs)] += 1
+
+    def simulateBatch(self, batchSize, rootEdges=None):
+        # Walk batchSize paths before evaluating anything. Virtual loss on each
+        # path steers the following walks elsewhere; the distinct leaves are
+        # then evaluated with a single predict call and all paths backed up.
+        # rootEdges optionally fixes the root edge of each path.
+        paths, leaves = self.walkPaths(batchSize, rootEdges)
+        preds = []
+        if leaves:
+            if self.stats is not None:
+                start = time.perf_counter()
+            preds = self.get_preds_batch(
+                [self.mcts.stateOf(leaf) for leaf in leaves])
+            if self.stats is not None:
+                self.stats.lap('evaluate', start)
+        self.backupPaths(paths, leaves, preds)
+
+    def walkPaths(self, batchSize, rootEdges=None):
+        # First half of simulateBatch: walk the paths under virtual loss and
+        # return them with the distinct leaves to evaluate (leaf -> index)
+        stats = self.stats
+        paths = []
+        for i in range(batchSize):
+            if stats is not None:
+                start = time.perf_counter()
+            leaf, value, done, breadcrumbs = self.mcts.moveToLeaf(
+                rootEdges[i] if rootEdges is not None else None)
+            self.mcts.virtualLoss(breadcrumbs, config.VIRTUAL_LOSS)
+            if stats is not None:
+                self._walked(stats, start, breadcrumbs)
+            paths.append((leaf, value, done, breadcrumbs))
+
+        leaves = {}
+        for leaf, _, done, _ in paths:
+            if done == 0 and leaf not in leaves:
+                leaves[leaf] = len(leaves)
+        return paths, leaves
+
+    def backupPaths(self, paths, leaves, preds):
+        # Second half of simulateBatch: expand the leaves with their
+        # predictions (in `leaves` order) and back all the paths up
+        stats = self.stats
+        for leaf, value, done, breadcrumbs in paths:
+            if stats is not None:
+                start = time.perf_counter()
+            self.mcts.virtualLoss(breadcrumbs, -config.VIRTUAL_LOSS)
+            if done == 0:
+                value, probs, allowedActions = preds[leaves[leaf]]
+                self.mcts.expand(leaf, allowedActions, probs[allowedActions])
+                if stats is not None:
+                    start = stats.lap('expand', start)
+            self.mcts.backFill(leaf, value, breadcrumbs)
+            if stats is not None:
+                stats.lap('backup', start)
+
+    def search(self, simulations, timeBudget=None, nodeBudget=None):
+        # Run `simulations` simulations and return how many were run. Passing
+        # timeBudget (seconds, which replaces the simulation count) or
+        # nodeBudget (tree size) makes the search anytime: it stops when a
+        # budget is used up, or earlier once the most visited root action can
+        # no longer be overtaken in the simulations left.
+        stop = None
+        if timeBudget is not None:
+            simulations = float('inf')
+        if timeBudget is not None or nodeBudget is not None:
+            stop = self._anytimeStop(simulations, timeBudget, nodeBudget)
+
+        batchSize = config.MCTS_BATCH_SIZE
+        if config.MCTS_THREADS > 1:
+            # no node ids may change while workers hold paths, so the cap is
+            # only enforced once the search is over
+            sim = self.treeParallelSearch(simulations, config.MCTS_THREADS, stop)
+            self.mcts.enforceNodeCap(config.MCTS_MAX_NODES)
+            return sim
+
+        sim = 0
+        while sim < simulations and not self.rootSolved() and \
+                not (stop is not None and stop(sim)):
             # lg.logger_mcts.info('***************************')
             # lg.logger_mcts.info('****** SIMULATION %d ******', sim + 1)
             # lg.logger_mcts.info('***************************')
+            if batchSize > 1:
+                batch = min(batchSize, simulations - sim)
+                self.simulateBatch(batch)
+                sim += batch
+            else:
+                self.simulate()
+                sim += 1
+            self.mcts.enforceNodeCap(config.MCTS_MAX_NODES)
+        return sim
+
+    def rootSolved(self):
+        # whether the solver has proven the root won or lost
+        proof = self.mcts.rootProof()
+        return len(proof) > 0 and ((proof == 1).any() or (proof == -1).all())
+
+    def gumbelSearch(self, simulations, tau):
+        # Gumbel root search: sample up to GUMBEL_ACTIONS root actions without
+        # replacement (Gumbel-top-k on the prior logits) and split the
+        # simulations over them by sequential halving. Each phase gives every
+        # remaining action an equal share of the budget left, then the best
+        # half by gumbel + logit + sigma(Q) stays. Below the root the search is
+        # the usual PUCT. Returns (action, pi, values) with pi the improved
+        # policy from MCTS.improvedPolicy; with tau = 0 no Gumbel noise is
+        # drawn, so the choice is deterministic.
+        if self.mcts.rootPrior().size == 0:
             self.simulate()
+            simulations -= 1
+
+        actions, N, Q = self.mcts.rootStats()
+        P = self.mcts.rootPrior()
+        logits = np.log(np.maximum(P, 1e-12))
+        gumbel = np.random.gumbel(size=len(P)) if tau != 0 else np.zeros(len(P))
+
+        remaining = np.argsort(-(gumbel + logits), kind='stable')[
+            :min(config.GUMBEL_ACTIONS, len(P))]
+        # halving m actions down to one takes floor(log2(m)) phases
+        phases = int(math.log2(len(remaining)))
+        batchSize = config.MCTS_BATCH_SIZE
+        for phase in range(phases):
+            if simulations <= 0:
+                break
+            visits = max(1, simulations // ((phases - phase) * len(remaining)))
+            rootEdges = np.repeat(remaining, visits)[:simulations]
+            simulations -= len(rootEdges)
+            for i in range(0, len(rootEdges), batchSize):
+                chunk = [int(e) for e in rootEdges[i:i + batchSize]]
+                if batchSize > 1:
+                    self.simulateBatch(len(chunk), chunk)
+                else:
+                    self.simulate(chunk[0])
+                self.mcts.enforceNodeCap(config.MCTS_MAX_NODES)
+
+            _, N, Q = self.mcts.rootStats()
+            scores = gumbel + logits + mc.gumbelSigma(Q, N)
+            remaining = remaining[np.argsort(-scores[remaining], kind='stable')]
+            remaining = remaining[:max(1, len(remaining) // 2)]
+
+        _, N, Q = self.mcts.rootStats()
+        scores = gumbel + logits + mc.gumbelSigma(Q, N)
+        action = int(actions[remaining[np.argmax(scores[remaining])]])
+
+        rootValue = self.get_preds(self.mcts.stateOf(self.mcts.root))[0]
+        pi = np.zeros(self.action_size)
+        values = np.zeros(self.action_size, dtype=np.float32)
+        pi[actions] = mc.improvedPolicy(P, N, Q, rootValue)
+        values[actions] = Q
+        return action, pi, values
+
+    def _anytimeStop(self, simulations, timeBudget, nodeBudget):
+        # stop(simulations run so far) for an anytime search, see search
+        start = time.perf_counter()
+
+        def stop(done):
+            # never before the root has a visit, or there is no move to read
+            # off it
+            _, N, _ = self.mcts.rootStats()
+            if np.sum(N) == 0:
+                return False
+
+            elapsed = time.perf_counter() - start
+            if timeBudget is not None and elapsed >= timeBudget:
+                return True
+            if nodeBudget is not None and len(self.mcts) >= nodeBudget:
+                return True
+
+            # simulations still to come, estimating the time left from the
+            # rate so far
+            remaining = simulations - done
+            if timeBudget is not None and done > 0:
+                remaining = min(remaining, (timeBudget - elapsed) * done / elapsed)
+
+            if len(N) < 2:
+                # with one legal action there is nothing to decide
+                return True
+            top = np.sort(N)[-2:]
+            return top[1] - top[0] > remaining
+
+        return stop
+
+    def treeParallelSearch(self, simulations, threads, stop=None):
+        # `threads` workers share self.mcts: each walks a path under the tree
+        # lock (virtual loss pushes concurrent walks apart), queues its leaf
+        # and waits. This thread serves the queue with batched predict calls
+        # until the simulation budget is used up, or stop(simulations started)
+        # says so. Returns the number of simulations run.
+        lock = threading.Lock()
+        requests = InferenceQueue()
+        started = [0]
+
+        def worker():
+            while True:
+                with lock:
+                    if started[0] >= simulations or self.rootSolved() or \
+                            (stop is not None and stop(started[0])):
+                        return
+                    started[0] += 1
+                    if self.stats is not None:
+                        start = time.perf_counter()
+                    leaf, value, done, breadcrumbs = self.mcts.moveToLeaf()
+                    self.mcts.virtualLoss(breadcrumbs, config.VIRTUAL_LOSS)
+                    if self.stats is not None:
+                        self._walked(self.stats, start, breadcrumbs)
+
+                if done == 0:
+                    if self.stats is not None:
+                        start = time.perf_counter()
+                    state = self.mcts.stateOf(leaf)
+                    if self.evaluator is not None:
+                        value, probs, allowedActions = self.evaluator.evaluate([state])[0]
+                    else:
+                        inputToModel = self.model.convertToModelInput(state)
+                        with lock:
+                            outputs = self.evalCache.get(inputToModel, self.model.version)
+                        if outputs is None:
+                            outputs = requests.submit(inputToModel).result()
+                            with lock:
+                                self.evalCache.put(inputToModel, self.model.version, outputs)
+                        # decodePreds writes into the logits, so it gets
+                        # copies of the cached rows
+                        value, probs, allowedActions = self.decodePreds(
+                            [state], *[[output.copy()] for output in outputs])[0]
+                    if self.stats is not None:
+                        # summed over the threads, so it can exceed wall time
+                        with lock:
+                            self.stats.lap('evaluate', start)
+
+                with lock:
+                    if self.stats is not None:
+                        start = time.perf_counter()
+                    self.mcts.virtualLoss(breadcrumbs, -config.VIRTUAL_LOSS)
+                    if done == 0:
+                        self.mcts.expand(leaf, allowedActions,
+                                         probs[allowedActions])
+                        if self.stats is not None:
+                            start = self.stats.lap('expand', start)
+                    self.mcts.backFill(leaf, value, breadcrumbs)
+                    if self.stats is not None:
+                        self.stats.lap('backup', start)
+
+        with ThreadPoolExecutor(threads) as pool:
+            workers = [pool.submit(worker) for _ in range(threads)]
+            while not all(w.done() for w in workers):
+                requests.serve(self.predict, threads, 0.001)
+            for w in workers:
+                w.result()
+        return started[0]
+
+    def rootParallelSearch(self, state, workers, timeBudget=None, nodeBudget=None):
+        # Split the simulation budget over `workers` processes, each searching
+        # its own tree from `state`, and merge the root edges: visit counts
+        # add up and Q becomes the visit-weighted mean. Every worker gets the
+        # whole time and node budgets.
+        if self._pool is None or self._poolSize != workers:
+            self.close()
+            self._pool = multiprocessing.get_context('spawn').Pool(workers)
+            self._poolSize = workers
+
+        model = self.model
+        modelArgs = (model.reg_const, model.learning_rate,
+                     model.input_dim, model.output_dim)
+        weights = model.get_weights()
+        seeds = np.random.randint(2**31 - 1, size=workers)
+        jobs = [(type(model), modelArgs, weights, state, self.action_size,
+                 self.MCTSsimulations // workers +
+                 (1 if w < self.MCTSsimulations % workers else 0),
+                 self.cpuct, int(seeds[w]), timeBudget, nodeBudget) for w in range(workers)]
+
+        N = np.zeros(self.action_size, dtype=int)
+        W = np.zeros(self.action_size, dtype=np.float32)
+        for actions, workerN, workerQ in self._pool.map(_rootSearchWorker, jobs):
+            N[actions] += workerN
+            W[actions] += workerN * workerQ
+
+        actions = np.array(state.allowedActions, dtype=int)
+        Q = np.where(N[actions] > 0, W[actions] / np.maximum(N[actions], 1), 0)
+        return actions, N[actions], Q.astype(np.float32)
+
+    def ponder(self, state):
+        # Keep searching from `state`, where the opponent is to move, on a
+        # background thread until the next act (or stopPondering). The tree
+        # is rooted at `state`, so act reuses whatever subtree the opponent's
+        # moves lead to. Root-parallel searches keep no tree between moves and
+        # information-set trees only hold the searching player's own
+        # decisions, so neither ponders.
+        self.stopPondering()
+        if config.MCTS_WORKERS > 1 or config.MCTS_TREE == 'ismcts':
+            return
+
+        if self.mcts == None or self.mcts.keyOf(state) not in self.mcts.tree:
+            self.buildMCTS(state)
+        else:
+            self.changeRootMCTS(state)
+
+        # the thread predicts while this one may be searching too
+        self.model.prepareThreads()
+        self._ponderStop = threading.Event()
+        self._ponderSimulations = 0
+        self._ponderThread = threading.Thread(
+            target=self._ponder, args=(self._ponderStop,), daemon=True)
+        self._ponderThread.start()
+
+    def _ponder(self, stopEvent):
+        batchSize = config.MCTS_BATCH_SIZE
+        maxNodes = config.PONDER_MAX_NODES
+        while not stopEvent.is_set() and not self.rootSolved() and \
+                not (maxNodes and len(self.mcts) >= maxNodes):
+            if batchSize > 1:
+                self.simulateBatch(batchSize)
+                self._ponderSimulations += batchSize
+            else:
+                self.simulate()
+                self._ponderSimulations += 1
+            self.mcts.enforceNodeCap(config.MCTS_MAX_NODES)
+
+    def stopPondering(self):
+        # stop the pondering thread, if any, and return how many simulations
+        # it ran
+        if self._ponderThread is None:
+            return 0
+        self._ponderStop.set()
+        self._ponderThread.join()
+        self._ponderThread = None
+        self._ponderStop = None
+        return self._ponderSimulations
+
+    def close(self):
+        # stop pondering and shut down the root-parallel worker pool, if one
+        # was started
+        self.stopPondering()
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+            self._poolSize = 0
+
+    def act(self, state, tau, timeBudget=None, nodeBudget=None):
+        # timeBudget (seconds) / nodeBudget (tree nodes) bound the search, see
+        # search; they default to MCTS_TIME_BUDGET / MCTS_NODE_BUDGET.
+        # With a shared server the agent holds a session while it acts, so
+        # the server only holds requests back for agents acting at once.
+        if self.server is None:
+            return self._act(state, tau, timeBudget, nodeBudget)
+        with self.server.session():
+            return self._act(state, tau, timeBudget, nodeBudget)
+
+    def _act(self, state, tau, timeBudget, nodeBudget):
+        if timeBudget is None:
+            timeBudget = config.MCTS_TIME_BUDGET or None
+        if nodeBudget is None:
+            nodeBudget = config.MCTS_NODE_BUDGET or None
+
+        pondered = self.stopPondering()
+        if pondered:
+            lg.logger_mcts.info('PONDERED %d SIMULATIONS', pondered)
+
+        rootStats = None
+        if config.MCTS_WORKERS > 1:
+            rootStats = self.rootParallelSearch(
+                state, config.MCTS_WORKERS, timeBudget, nodeBudget)
+        else:
+            self.prepareTree(state)
+
+            if config.MCTS_STATS:
+                self.stats = self.mcts.stats = mc.SearchStats()
+
+            if config.MCTS_ROOT == 'gumbel':
+                action, pi, values = self.gumbelSearch(self.MCTSsimulations, tau)
+                value = values[action]
+            else:
+                # run the simulation
+                self.search(self.MCTSsimulations, timeBudget, nodeBudget)
+                rootStats = self.mcts.rootStats()
+
+            if self.stats is not None:
+                self.searchRecords.append(self.stats.record(self.mcts))
+                self.stats = self.mcts.stats = None
 
-        # get action values
-        pi, values = self.getAV(1)
+        if rootStats is not None:
+            # get action values
+            pi, values = self.getAV(1, rootStats)
 
-        # pick the action
-        action, value = self.chooseAction(pi, values, tau)
+            # pick the action
+            action, value = self.chooseAction(pi, values, tau)
+
+        if config.MCTS_WORKERS <= 1:
+            action, pi, value = self.playProvenWin(action, pi, value)
 
         nextState, _, _, _, _ = state.takeAction(action)
 
@@ -100,22 +546,66 @@ class Agent():
 
         return (action, pi, value, NN_value)
 
+    def prepareTree(self, state):
+        # root the search tree at `state`, keeping the current tree if it holds it
+        if self.mcts == None or self.mcts.keyOf(state) not in self.mcts.tree:
+            self.buildMCTS(state)
+        else:
+            self.changeRootMCTS(state)
+
+    def playProvenWin(self, action, pi, value):
+        # a proven win is played outright and is the policy target; otherwise
+        # the chosen move stands
+        proof = self.mcts.rootProof()
+        if not (proof == 1).any():
+            return action, pi, value
+        actions = self.mcts.rootStats()[0]
+        action = int(actions[np.argmax(proof == 1)])
+        pi = np.zeros(self.action_size)
+        pi[action] = 1
+        return action, pi, 1.0
+
+    def fork(self):
+        # An agent for another game played at the same time: it shares this
+        # agent's model, evaluator and evaluation cache but has its own tree.
+        agent = copy.copy(self)
+        agent.mcts = None
+        agent.stats = None
+        agent.searchRecords = []
+        agent._pool = None
+        agent._poolSize = 0
+        agent._ponderThread = None
+        agent._ponderStop = None
+        return agent
+
     def get_preds(self, state):
         # predict the leaf
-        inputToModel = np.array([self.model.convertToModelInput(state)])
+        return self.get_preds_batch([state])[0]
 
-        preds = self.model.predict(inputToModel)
-        value_array = preds[0]
-        logits_array = preds[1]
-        value = value_array[0]
+    def get_preds_batch(self, states):
+        # predict several leaves with one model call; inputs found in the
+        # evaluation cache are left out of it
+        if self.evaluator is not None:
+            return self.evaluator.evaluate(states)
 
-        logits = logits_array[0]
+        inputToModel = np.array(
+            [self.model.convertToModelInput(state) for state in states])
 
-        allowedActions = state.allowedActions
+        version = self.model.version
+        outputs = [self.evalCache.get(x, version) for x in inputToModel]
+        missing = [i for i, output in enumerate(outputs) if output is None]
+        if missing:
+            preds = self.predict(inputToModel[missing])
+            for row, i in enumerate(missing):
+                outputs[i] = tuple(output[row] for output in preds)
+                self.evalCache.put(inputToModel[i], version, outputs[i])
 
-        mask = np.ones(logits.shape, dtype=bool)
-        mask[allowedActions] = False
-        logits[mask] = -100
+        # decodePreds writes into the logits, so it gets copies of the cached rows
+        return self.decodePreds(states, np.array([output[0] for output in outputs]),
+                                np.array([output[1] for output in outputs]))
+
+    def decodePreds(self, states, value_array, logits_array):
+        # (value, probs, allowedActions) per state from raw model outputs
 
         # SOFTMAX NORMALIZED
         def softmax_normalize(x):
@@ -123,50 +613,61 @@ class Agent():
             y = np.exp(x - b)
             return y / y.sum()
 
-        probs = softmax_normalize(logits)  # put this just before the for?
+        results = []
+        for i, state in enumerate(states):
+            value = value_array[i][0]
+            logits = logits_array[i]
+
+            allowedActions = state.allowedActions
+
+            mask = np.ones(logits.shape, dtype=bool)
+            mask[allowedActions] = False
+            logits[mask] = -100
 
-        return ((value, probs, allowedActions))
+            probs = softmax_normalize(logits)
+
+            results.append((value, probs, allowedActions))
+
+        return results
 
     def evaluateLeaf(self, leaf, value, done, breadcrumbs):
 
         # lg.logger_mcts.info('------EVALUATING LEAF------')
 
         if done == 0:
+            stats = self.stats
+            if stats is not None:
+                start = time.perf_counter()
 
-            value, probs, allowedActions = self.get_preds(leaf.state)
+            value, probs, allowedActions = self.get_preds(
+                self.mcts.stateOf(leaf))
             # lg.logger_mcts.info('PREDICTED VALUE FOR %d: %f',
             #                     leaf.state.playerTurn, value)
+            if stats is not None:
+                start = stats.lap('evaluate', start)
 
             probs = probs[allowedActions]
 
-            for idx, action in enumerate(allowedActions):
-                # newState, _, _, _, _ = leaf.state.takeAction(action)
-                # if newState.id not in self.mcts.tree:
-                #     node = mc.Node(newState)
-                #     self.mcts.addNode(node)
-                #     lg.logger_mcts.info(
-                #         'added node...%s...p = %f', node.id, probs[idx])
-                # else:
-                #     node = self.mcts.tree[newState.id]
-                #     lg.logger_mcts.info('existing node...%s...', node.id)
-
-                newEdge = mc.Edge(leaf, probs[idx], action)
-                leaf.edges.append((action, newEdge))
+            self.mcts.expand(leaf, allowedActions, probs)
+            if stats is not None:
+                stats.lap('expand', start)
 
         else:
             lg.logger_mcts.info('GAME VALUE FOR %d: %f',
-                                leaf.playerTurn, value)
+                                self.mcts.stateOf(leaf).playerTurn, value)
 
         return ((value, breadcrumbs))
 
-    def getAV(self, tau):
-        edges = self.mcts.root.edges
-        pi = np.zeros(self.action_size, dtype=np.integer)
+    def getAV(self, tau, rootStats=None):
+        actions, N, Q = rootStats if rootStats is not None else self.mcts.rootStats()
+        pi = np.zeros(self.action_size, dtype=int)
         values = np.zeros(self.action_size, dtype=np.float32)
 
-        for action, edge in edges:
-            pi[action] = pow(edge.stats['N'], 1/tau)
-            values[action] = edge.stats['Q']
+        pi[actions] = np.power(N, 1/tau)
+        values[actions] = Q
+        if np.sum(pi) == 0:
+            # no root visits (a search cut short): every action alike
+            pi[actions] = 1
 
         pi = pi / (np.sum(pi) * 1.0)
         return pi, values
@@ -220,16 +721,30 @@ class Agent():
         self.model.printWeightAverages()
 
     def predict(self, inputToModel):
+        if self.server is not None:
+            return self.server.predict(self.model, inputToModel).result()
         preds = self.model.predict(inputToModel)
         return preds
 
     def buildMCTS(self, state):
         lg.logger_mcts.info(
             '****** BUILDING NEW MCTS TREE FOR AGENT %s ******', self.name)
-        self.root = mc.Node(state)
-        self.mcts = mc.MCTS(self.root, self.cpuct)
+        if config.MCTS_TREE == 'array':
+            self.mcts = mc.ArrayMCTS(state, self.cpuct)
+            self.root = self.mcts.root
+        elif config.MCTS_TREE == 'ismcts':
+            self.root = mc.Node(state, state.infoSetHash(state.playerTurn))
+            self.mcts = mc.ISMCTS(self.root, self.cpuct)
+        else:
+            self.root = mc.Node(state)
+            self.mcts = mc.MCTS(self.root, self.cpuct)
+
+        if self.snapshots is not None:
+            restored = self.snapshots.restore(self.mcts)
+            if restored:
+                lg.logger_mcts.info('****** RESTORED %d NODES FROM SNAPSHOT ******', restored)
 
     def changeRootMCTS(self, state):
         lg.logger_mcts.info(
-            '****** CHANGING ROOT OF MCTS TREE TO %s FOR AGENT %s ******', state.id, self.name)
-        self.mcts.root = self.mcts.tree[state.id]
+            '****** CHANGING ROOT OF MCTS TREE TO %x FOR AGENT %s ******', state.hash, self.name)
+        self.mcts.changeRoot(self.mcts.keyOf(state))
@@ -0,0 +1,472 @@
+# Micro-benchmarks for the self-play hot paths.
+#
+#   python benchmark.py tree        # MCTS vs ArrayMCTS: nodes/second, bytes/node
+#   python benchmark.py batch       # Agent.act simulations/second vs MCTS_BATCH_SIZE
+#   python benchmark.py threads     # Agent.act simulations/second vs MCTS_THREADS
+#   python benchmark.py hash        # string state ids vs Zobrist hashes
+#   python benchmark.py chance      # tree fragmentation with and without chance nodes
+#   python benchmark.py ismcts      # tree size and depth, full-state vs information-set keys
+#   python benchmark.py rollout     # playouts/second, and Agent.act with the rollout evaluator
+#   python benchmark.py inference   # Keras predict vs the NumPy forward pass: agreement, latency
+#   python benchmark.py states      # GameState constructions and takeAction calls per second
+#   python benchmark.py apply       # takeAction vs in-place apply/undo: steps/second, bytes/step
+#   python benchmark.py ekgame      # ExplodingKittensGame random games: steps/second
+#   python benchmark.py batchgame   # ExplodingKittensBatchGame random games: steps/second vs N
+#   python benchmark.py deals       # game resets/second, dealt one by one vs from a deal stream
+#
+# The tree, chance and ismcts benchmarks expand leaves with uniform priors and a value of 0
+# instead of calling the network, so it measures the tree and game code only.
+# The rollout benchmark uses no network at all; the others run a freshly
+# initialised Densely_connected_net.
+
+import argparse
+import logging
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import MCTS as mc
+import game
+from game import Game, GameState
+
+import config
+
+
+def _initialState(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    return Game().gameState
+
+
+def _buildTree(tree, state):
+    if tree == 'array':
+        return mc.ArrayMCTS(state, config.CPUCT)
+    if tree == 'ismcts':
+        return mc.ISMCTS(mc.Node(state, state.infoSetHash(state.playerTurn)), config.CPUCT)
+    return mc.MCTS(mc.Node(state), config.CPUCT)
+
+
+def _uniformSearch(mcts, simulations):
+    # returns the mean depth of the simulated paths
+    depth = 0
+    for _ in range(simulations):
+        leaf, value, done, breadcrumbs = mcts.moveToLeaf()
+        depth += len(breadcrumbs)
+        if done == 0:
+            allowedActions = mcts.stateOf(leaf).allowedActions
+            probs = np.full(len(allowedActions), 1.0 / len(allowedActions))
+            mcts.expand(leaf, allowedActions, probs)
+        mcts.backFill(leaf, value, breadcrumbs)
+    return depth / simulations
+
+
+def benchmarkTree(simulations, seed):
+    print('%-6s %10s %12s %12s %14s' %
+          ('tree', 'nodes', 'nodes/s', 'bytes/node', 'array bytes/node'))
+    for tree in ['node', 'array']:
+        mcts = _buildTree(tree, _initialState(seed))
+        start = time.perf_counter()
+        _uniformSearch(mcts, simulations)
+        elapsed = time.perf_counter() - start
+
+        # memory is measured on a separate, identical run so tracing does not
+        # slow down the timed one
+        tracemalloc.start()
+        mcts = _buildTree(tree, _initialState(seed))
+        _uniformSearch(mcts, simulations)
+        allocated, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        arrayBytes = '%.1f' % (mcts.nbytes() / len(mcts)) \
+            if tree == 'array' else '-'
+        print('%-6s %10d %12.0f %12.1f %14s' % (
+            tree, len(mcts), len(mcts) / elapsed, allocated / len(mcts), arrayBytes))
+
+
+def _randomPlayouts(games, seed):
+    random.seed(seed)
+    states = []
+    for _ in range(games):
+        state = Game().gameState
+        done = 0
+        while done == 0:
+            states.append(state)
+            state, _, done, _, _ = state.takeAction(
+                random.choice(state.allowedActions))
+    return states
+
+
+def benchmarkHash(games, seed):
+    states = _randomPlayouts(games, seed)
+
+    def perState(f):
+        start = time.perf_counter()
+        for state in states:
+            f(state)
+        return (time.perf_counter() - start) / len(states) * 1e6
+
+    def fullHash(state):
+        return game._deckHash(state.deck) ^ game._discardHash(state.discard) ^ \
+            game._handHash(state.currentHand, state.currentPlayer) ^ \
+            game._handHash(state.opposingHand, -state.currentPlayer)
+
+    def incrementalHash(state):
+        return state._deckHash ^ state._discardHash ^ state._handsHash
+
+    print('%d states' % len(states))
+    print('string id:        %6.2f us/state  %5.0f key bytes' % (
+        perState(GameState._convertStateToId),
+        np.mean([sys.getsizeof(state.id) for state in states])))
+    print('Zobrist, full:    %6.2f us/state  %5.0f key bytes' % (
+        perState(fullHash), np.mean([sys.getsizeof(state.hash) for state in states])))
+
+    # takeAction now updates the hash incrementally and no longer builds the id
+    start = time.perf_counter()
+    _randomPlayouts(games, seed)
+    print('random playout:   %6.2f us/state' %
+          ((time.perf_counter() - start) / len(states) * 1e6))
+
+
+def benchmarkStates(games, seed):
+    states = _randomPlayouts(games, seed)
+
+    # with the hashes passed in, as takeAction does
+    start = time.perf_counter()
+    for state in states:
+        GameState(state.deck, state.currentHand, state.opposingHand, state.discard,
+                  state.lastPlayedCard, state.currentPlayer,
+                  (state._deckHash, state._discardHash, state._handsHash))
+    constructed = len(states) / (time.perf_counter() - start)
+
+    # every child of every state, as a search expanding them would make
+    random.seed(seed)
+    children = 0
+    start = time.perf_counter()
+    for state in states:
+        for action in state.allowedActions:
+            state.takeAction(action)
+            children += 1
+    stepped = children / (time.perf_counter() - start)
+
+    print('%d states' % len(states))
+    print('GameState():  %10.0f states/s' % constructed)
+    print('takeAction:   %10.0f states/s' % stepped)
+
+
+def benchmarkApply(games, seed):
+    # Random games walked down with takeAction (a new state per step, the
+    # path kept as a search holds it) and with apply then back up with undo
+    # (one state, a token per step). Each walk of a game restores the random
+    # state it was first played from, so both see the same events.
+    random.seed(seed)
+    chooser = random.Random(seed)
+    walks = []
+    for _ in range(games):
+        root = Game().gameState
+        randomState = random.getstate()
+        state, actions, done = root, [], 0
+        while done == 0:
+            actions.append(chooser.choice(state.allowedActions))
+            state, _, done, _, _ = state.takeAction(actions[-1])
+        walks.append((root, randomState, actions))
+
+    def takeActions(root, actions):
+        path = [root]
+        for action in actions:
+            path.append(path[-1].takeAction(action)[0])
+
+    def applyUndo(root, actions):
+        state = root.copy()
+        tokens = [state.apply(action) for action in actions]
+        for token in reversed(tokens):
+            state.undo(token)
+
+    steps = sum(len(actions) for _, _, actions in walks)
+    print('%d steps' % steps)
+    for name, walk in [('takeAction', takeActions), ('apply/undo', applyUndo)]:
+        elapsed = 0
+        for root, randomState, actions in walks:
+            random.setstate(randomState)
+            start = time.perf_counter()
+            walk(root, actions)
+            elapsed += time.perf_counter() - start
+
+        peak = 0
+        for root, randomState, actions in walks:
+            random.setstate(randomState)
+            tracemalloc.start()
+            walk(root, actions)
+            peak += tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        print('%-12s %10.0f steps/s %8.0f peak bytes/step' % (name, steps / elapsed, peak / steps))
+
+
+def benchmarkEKGame(games, seed, configFile):
+    # Random games of the ExplodingKittensGame engine: each step plays a
+    # random playable card or draws. Its logger is quietened for the run, so
+    # the engine is timed rather than the log records.
+    from ExplodingKittensGame import ExplodingKittensGame
+
+    ekLogger = logging.getLogger('ExplodingKittensGame')
+    level = ekLogger.level
+    ekLogger.setLevel(logging.WARNING)
+
+    random.seed(seed)
+    np.random.seed(seed)
+    chooser = random.Random(seed)
+    ekg = ExplodingKittensGame(configFile)
+    steps = 0
+    start = time.perf_counter()
+    for _ in range(games):
+        ekg.reset()
+        while not ekg.game_state.game_over:
+            playable = sorted(ekg.game_state.playable_card_types)
+            choice = chooser.randrange(len(playable) + 1)
+            if choice == len(playable):
+                ekg.draw_card()
+            else:
+                ekg.play_card(playable[choice])
+            steps += 1
+    elapsed = time.perf_counter() - start
+    ekLogger.setLevel(level)
+
+    print('%d games, %d steps' % (games, steps))
+    print('ExplodingKittensGame: %10.0f steps/s' % (steps / elapsed))
+
+
+def benchmarkBatchGame(seed, configFile, gameCounts, rounds):
+    # N random games stepped together for `rounds` steps, finished games
+    # dealt again as they end, so every step advances N games
+    from ExplodingKittensBatchGame import ExplodingKittensBatchGame
+
+    print('%8s %12s %12s' % ('games', 'steps/s', 'games/s'))
+    for numGames in gameCounts:
+        batch = ExplodingKittensBatchGame(configFile, numGames, seed)
+        finished = 0
+        start = time.perf_counter()
+        for _ in range(rounds):
+            done = batch.step(batch.random_actions())
+            if done.any():
+                finished += np.count_nonzero(done)
+                batch.reset(done)
+        elapsed = time.perf_counter() - start
+        print('%8d %12.0f %12.0f' % (numGames, numGames * rounds / elapsed, finished / elapsed))
+
+
+def benchmarkDeals(games, seed, configFile, batchSize):
+    from ExplodingKittensGame import ExplodingKittensGame
+    from ExplodingKittensBatchGame import deal_stream
+
+    ekLogger = logging.getLogger('ExplodingKittensGame')
+    level = ekLogger.level
+    ekLogger.setLevel(logging.WARNING)
+
+    random.seed(seed)
+    ekg = ExplodingKittensGame(configFile)
+    resets = [
+        ('Game', Game(), Game(game.dealStream(batchSize))),
+        ('ExplodingKittensGame', ekg,
+         ExplodingKittensGame(configFile, deals=deal_stream(ekg.game_config, batchSize, seed))),
+    ]
+    print('%-22s %14s %14s' % ('', 'one by one/s', 'streamed/s'))
+    for name, single, streamed in resets:
+        rates = []
+        for env in [single, streamed]:
+            start = time.perf_counter()
+            for _ in range(games):
+                env.reset()
+            rates.append(games / (time.perf_counter() - start))
+        print('%-22s %14.0f %14.0f' % (name, rates[0], rates[1]))
+    ekLogger.setLevel(level)
+
+
+def benchmarkChance(simulations, seed, moves):
+    # Uniform searches from `moves` random opening states. Without chance nodes
+    # every traversal of a steal/shuffle edge can land on a new child, so the
+    # same simulations spread over more, less visited nodes.
+    print('%-8s %10s %12s %14s' % ('chance', 'nodes', 'visits/node', 'visited <= 1'))
+    for chance in [False, True]:
+        config.MCTS_CHANCE_NODES = chance
+        nodes = visits = sparse = 0
+        for move in range(moves):
+            mcts = _buildTree('array', _initialState(seed + move))
+            _uniformSearch(mcts, simulations)
+            nodes += len(mcts)
+            visits += mcts.visits[:len(mcts)].sum()
+            sparse += (mcts.visits[:len(mcts)] <= 1).sum()
+        print('%-8s %10.0f %12.2f %13.0f%%' % (
+            'on' if chance else 'off', nodes / moves, visits / nodes, 100.0 * sparse / nodes))
+
+
+def benchmarkISMCTS(simulations, seed, moves):
+    # Uniform searches from `moves` random opening states. The full-state tree
+    # sees the real deck order, so its draws are fixed; the information-set
+    # tree branches on every card the searching player might draw, but pools
+    # the statistics of all the states they cannot tell apart.
+    print('%-8s %10s %12s %12s' % ('tree', 'nodes', 'visits/node', 'mean depth'))
+    for tree in ['node', 'ismcts']:
+        nodes = visits = depth = 0
+        for move in range(moves):
+            mcts = _buildTree(tree, _initialState(seed + move))
+            depth += _uniformSearch(mcts, simulations)
+            nodes += len(mcts)
+            visits += sum(node.visits for node in mcts.tree.values())
+        print('%-8s %10.0f %12.2f %12.2f' % (
+            tree, nodes / moves, visits / nodes, depth / moves))
+
+
+def benchmarkRollout(simulations, seed, moves, games):
+    from agent import Agent
+    from evaluator import RolloutEvaluator
+
+    def takeActionPlayout(state):
+        done = 0
+        while done == 0:
+            state, _, done, _, _ = state.takeAction(random.choice(state.allowedActions))
+
+    # game.playout against random games played through takeAction
+    states = [_initialState(seed + i) for i in range(games)]
+    for name, f in [
+            ('takeAction', takeActionPlayout),
+            ('playout', lambda state: game.playout(state)),
+            ('heuristic', lambda state: game.playout(state, heuristic=True))]:
+        start = time.perf_counter()
+        for state in states:
+            f(state)
+        print('%-12s %10.0f playouts/s' % (name, games / (time.perf_counter() - start)))
+
+    env = Game()
+    print('%8s %12s' % ('rollouts', 'sims/s'))
+    for rollouts in [1, 4, 16]:
+        agent = Agent('benchmark', env.state_size, env.action_size, simulations,
+                      config.CPUCT, None, RolloutEvaluator(env.action_size, rollouts))
+        print('%8d %12.0f' % (rollouts, simulations * moves / _timeAct(agent, seed, moves)))
+
+
+def benchmarkInference(seed, games, batchSizes):
+    from model import Densely_connected_net, DenseInference
+
+    env = Game()
+    net = Densely_connected_net(
+        config.REG_CONST, config.LEARNING_RATE, env.input_shape, env.action_size)
+    engine = DenseInference(net.model)
+    inputs = np.array([net.convertToModelInput(state)
+                       for state in _randomPlayouts(games, seed)])
+
+    expected = net.model.predict(inputs)
+    actual = engine.predict(inputs)
+    print('%d states, max |keras - numpy|: value %.2e, policy %.2e' % (
+        len(inputs), np.abs(expected[0] - actual[0]).max(), np.abs(expected[1] - actual[1]).max()))
+
+    def perCall(predict, batch, calls):
+        start = time.perf_counter()
+        for _ in range(calls):
+            predict(batch)
+        return (time.perf_counter() - start) / calls * 1e6
+
+    print('%6s %14s %14s %10s' % ('batch', 'keras us/call', 'numpy us/call', 'speedup'))
+    for batchSize in batchSizes:
+        batch = inputs[:batchSize]
+        kerasTime = perCall(net.model.predict, batch, 50)
+        numpyTime = perCall(engine.predict, batch, 2000)
+        print('%6d %14.1f %14.1f %9.1fx' % (batchSize, kerasTime, numpyTime, kerasTime / numpyTime))
+
+
+def _agent(simulations):
+    from agent import Agent
+    from model import Densely_connected_net
+
+    env = Game()
+    net = Densely_connected_net(
+        config.REG_CONST, config.LEARNING_RATE, env.input_shape, env.action_size)
+    return Agent('benchmark', env.state_size, env.action_size,
+                 simulations, config.CPUCT, net)
+
+
+def _timeAct(agent, seed, moves):
+    # seconds spent in `moves` calls to act, each on a fresh tree
+    elapsed = 0
+    for move in range(moves):
+        state = _initialState(seed + move)
+        agent.mcts = None
+        start = time.perf_counter()
+        agent.act(state, 1)
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+
+def benchmarkBatch(simulations, seed, moves, batchSizes):
+    agent = _agent(simulations)
+    _timeAct(agent, seed, 1)  # warm up predict
+
+    print('%6s %12s %10s' % ('K', 'sims/s', 'speedup'))
+    base = None
+    for batchSize in batchSizes:
+        config.MCTS_BATCH_SIZE = batchSize
+        simsPerSecond = simulations * moves / _timeAct(agent, seed, moves)
+        base = base or simsPerSecond
+        print('%6d %12.0f %9.2fx' % (batchSize, simsPerSecond, simsPerSecond / base))
+
+
+def benchmarkThreads(simulations, seed, moves, threadCounts):
+    agent = _agent(simulations)
+    config.MCTS_BATCH_SIZE = 1
+    _timeAct(agent, seed, 1)  # warm up predict
+
+    # threads = 1 is the plain single-threaded simulate loop
+    print('%8s %12s %10s' % ('threads', 'sims/s', 'speedup'))
+    base = None
+    for threads in threadCounts:
+        config.MCTS_THREADS = threads
+        simsPerSecond = simulations * moves / _timeAct(agent, seed, moves)
+        base = base or simsPerSecond
+        print('%8d %12.0f %9.2fx' % (threads, simsPerSecond, simsPerSecond / base))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run self-play micro-benchmarks.")
+    parser.add_argument('benchmark', choices=['tree', 'batch', 'threads', 'hash', 'chance',
+                                                  'ismcts', 'rollout', 'inference', 'states',
+                                                  'apply', 'ekgame', 'batchgame', 'deals'])
+    parser.add_argument('--simulations', type=int, default=None)
+    parser.add_argument('--moves', type=int, default=5)
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--game-config', default='game_config.json')
+    parser.add_argument('--num-games', type=int, nargs='+', default=[1, 100, 1000, 10000])
+    args = parser.parse_args()
+
+    if args.benchmark == 'tree':
+        benchmarkTree(args.simulations or 5000, args.seed)
+    elif args.benchmark == 'batch':
+        benchmarkBatch(args.simulations or 200, args.seed, args.moves,
+                       args.batch_sizes)
+    elif args.benchmark == 'hash':
+        benchmarkHash(args.games, args.seed)
+    elif args.benchmark == 'states':
+        benchmarkStates(args.games, args.seed)
+    elif args.benchmark == 'apply':
+        benchmarkApply(args.games, args.seed)
+    elif args.benchmark == 'ekgame':
+        benchmarkEKGame(args.games, args.seed, args.game_config)
+    elif args.benchmark == 'batchgame':
+        benchmarkBatchGame(args.seed, args.game_config, args.num_games, args.moves * 100)
+    elif args.benchmark == 'deals':
+        benchmarkDeals(args.games * 100, args.seed, args.game_config, config.DEAL_BATCH_SIZE or 256)
+    elif args.benchmark == 'chance':
+        benchmarkChance(args.simulations or 2000, args.seed, args.moves)
+    elif args.benchmark == 'ismcts':
+        benchmarkISMCTS(args.simulations or 2000, args.seed, args.moves)
+    elif args.benchmark == 'rollout':
+        benchmarkRollout(args.simulations or 1000, args.seed, args.moves, args.games)
+    elif args.benchmark == 'inference':
+        benchmarkInference(args.seed, args.games, args.batch_sizes)
+    elif args.benchmark == 'threads':
+        benchmarkThreads(args.simulations or 200, args.seed, args.moves,
+                         args.threads)
@@ -6,6 +6,41 @@ TURNS_UNTIL_TAU0 = 10  # turn on which it starts playing deterministically
 CPUCT = 3
 EPSILON = 0.2
 ALPHA = 0.8
+MCTS_TREE = 'node'  # 'node' (Node/Edge objects), 'array' (ArrayMCTS) or 'ismcts' (information sets)
+MCTS_BATCH_SIZE = 1  # leaves evaluated per predict call (1 = one leaf per simulation)
+VIRTUAL_LOSS = 1
+MCTS_WORKERS = 1  # processes for root-parallel search (1 = search in-process)
+# Tree parallelism is slower than one thread here, since the GIL serialises the
+# search: benchmark.py threads measured 0.67x at 2 threads, 0.74x at 4, 0.83x at 8.
+MCTS_THREADS = 1  # threads sharing one tree in tree-parallel search (1 = off)
+MCTS_MAX_NODES = 0  # tree size cap; unexpanded leaves behind the least taken edges are evicted past it (0 = no cap)
+MCTS_CHANCE_NODES = False  # branch on enumerated steal/shuffle/defuse outcomes instead of sampling them
+MCTS_SHUFFLE_SAMPLES = 4  # sampled deck orders standing in for a shuffle's outcomes
+MCTS_TIME_BUDGET = 0  # seconds of search per move, replacing MCTS_SIMS (0 = off)
+MCTS_NODE_BUDGET = 0  # stop searching once the tree holds this many nodes (0 = off)
+MCTS_SOLVER = False  # prove won/lost subtrees and stop searching them
+MCTS_ROOT = 'puct'  # root action selection: 'puct', or 'gumbel' (sequential halving)
+GUMBEL_ACTIONS = 16  # root actions sampled for sequential halving
+GUMBEL_C_VISIT = 50
+GUMBEL_C_SCALE = 1.0
+PONDER = False  # agents keep searching on a background thread while the opponent moves
+PONDER_MAX_NODES = 50000  # pondering stops once the tree holds this many nodes (0 = no limit)
+MCTS_EVALUATOR = 'network'  # leaf values from the 'network' or from random 'rollout's
+ROLLOUTS = 4  # playouts averaged per leaf by the rollout evaluator
+ROLLOUT_HEURISTIC = False  # rollout players without a defuse avoid drawing
+ROLLOUT_MAX_MOVES = 500  # playouts still running after this many moves count as draws
+MCTS_SNAPSHOT_FILE = None  # snapshot.py file ismcts self-play saves its first-move trees to and buildMCTS warm-starts from
+SNAPSHOT_DEPTH = 3  # levels below the root kept in a saved snapshot
+SNAPSHOT_MIN_VISITS = 1  # nodes whose parent edge was taken fewer times are left out of snapshots
+SNAPSHOT_MAX_TREES = 1000  # trees a snapshot file keeps, newest first (0 = no limit)
+LOCKSTEP_GAMES = 1  # games self-play and evaluation run at once, sharing predict calls (1 = one by one)
+DEAL_BATCH_SIZE = 256  # initial deals a match or gym env deals at once with NumPy (0 = each game deals its own)
+MCTS_STATS = False  # time the search phases; Agent.searchRecords gets one record per move
+NUMPY_INFERENCE = False  # run Densely_connected_net's forward pass in NumPy instead of Keras
+INFERENCE_SERVER = False  # route every agent's predict calls through one shared batching server
+INFERENCE_BATCH_SIZE = 64  # rows the server waits for before running a batch
+INFERENCE_MAX_LATENCY = 0.002  # seconds a request waits for its batch to fill
+EVAL_CACHE_SIZE = 10000  # model outputs kept per agent, least recently used dropped first (0 = off)
 
 
 # RETRAINING
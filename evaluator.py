@@ -0,0 +1,37 @@
+import numpy as np
+
+from game import playout
+
+import config
+
+
+# Leaf evaluators for the search. An evaluator has evaluate(states), which
+# returns one (value, probs, allowedActions) tuple per state in the format of
+# Agent.get_preds_batch: value for the state's player to move, probs over the
+# whole action space. An Agent with no evaluator asks its network.
+
+
+class RolloutEvaluator():
+    # Values a state by playing it out to the end `rollouts` times with
+    # game.playout and averaging the results; the prior is uniform over the
+    # allowed actions. No network is involved.
+
+    def __init__(self, action_size, rollouts=config.ROLLOUTS,
+                 heuristic=config.ROLLOUT_HEURISTIC, maxMoves=config.ROLLOUT_MAX_MOVES):
+        self.action_size = action_size
+        self.rollouts = rollouts
+        self.heuristic = heuristic
+        self.maxMoves = maxMoves
+
+    def evaluate(self, states):
+        results = []
+        for state in states:
+            value = sum(playout(state, self.heuristic, self.maxMoves)
+                        for _ in range(self.rollouts)) / self.rollouts
+
+            allowedActions = state.allowedActions
+            probs = np.zeros(self.action_size)
+            probs[allowedActions] = 1.0 / len(allowedActions)
+
+            results.append((value, probs, allowedActions))
+        return results
@@ -3,10 +3,12 @@ import random
 
 import loggers as lg
 
-from game import Game, GameState
+from game import Game, GameState, dealStream
 from model import Densely_connected_net
 
 from agent import Agent, User
+from memory import Memory
+from snapshot import saveSnapshot, takeSnapshot
 
 import config
 
@@ -22,7 +24,7 @@ def playMatchesBetweenVersions(env, run_version, player1version, player2version,
         if player1version > 0:
             player1_network = player1_NN.read(
                 env.name, run_version, player1version)
-            player1_NN.model.set_weights(player1_network.get_weights())
+            player1_NN.set_weights(player1_network.get_weights())
         player1 = Agent('player1', env.state_size, env.action_size,
                         config.MCTS_SIMS, config.CPUCT, player1_NN)
 
@@ -35,7 +37,7 @@ def playMatchesBetweenVersions(env, run_version, player1version, player2version,
         if player2version > 0:
             player2_network = player2_NN.read(
                 env.name, run_version, player2version)
-            player2_NN.model.set_weights(player2_network.get_weights())
+            player2_NN.set_weights(player2_network.get_weights())
         player2 = Agent('player2', env.state_size, env.action_size,
                         config.MCTS_SIMS, config.CPUCT, player2_NN)
 
@@ -45,12 +47,70 @@ def playMatchesBetweenVersions(env, run_version, player1version, player2version,
     return (scores, memory, points, sp_scores)
 
 
+def _recordResult(state, value, players, logger, scores, sp_scores, points):
+    # add a finished game to the scores; value is from the POV of state.playerTurn
+    if value == 1:
+        logger.info('%s WINS!', players[state.playerTurn]['name'])
+        scores[players[state.playerTurn]['name']
+               ] = scores[players[state.playerTurn]['name']] + 1
+        if state.playerTurn == 1:
+            sp_scores['sp'] = sp_scores['sp'] + 1
+        else:
+            sp_scores['nsp'] = sp_scores['nsp'] + 1
+
+    elif value == -1:
+        logger.info('%s WINS!', players[-state.playerTurn]['name'])
+        scores[players[-state.playerTurn]['name']
+               ] = scores[players[-state.playerTurn]['name']] + 1
+
+        if state.playerTurn == 1:
+            sp_scores['nsp'] = sp_scores['nsp'] + 1
+        else:
+            sp_scores['sp'] = sp_scores['sp'] + 1
+
+    else:
+        logger.info('DRAW...')
+        scores['drawn'] = scores['drawn'] + 1
+        sp_scores['drawn'] = sp_scores['drawn'] + 1
+
+    pts = state.score
+    points[players[state.playerTurn]['name']].append(pts[0])
+    points[players[-state.playerTurn]['name']].append(pts[1])
+
+
+def _deals(games):
+    # a stream of initial deals for a match that deals `games` games, or None
+    # to deal each game as it starts. Batches are no larger than the match
+    # needs, and the stream is seeded from `random`, so random.seed still
+    # reproduces the games.
+    if not config.DEAL_BATCH_SIZE:
+        return None
+    return dealStream(min(config.DEAL_BATCH_SIZE, games), random.getrandbits(64))
+
+
+def _snapshot(agent, snapshots, memory, turn):
+    # keep the tree of each self-play game's first move for MCTS_SNAPSHOT_FILE;
+    # they are written out together once the match is over. Only information
+    # set roots come up again: a full-state root is one random deal.
+    if config.MCTS_SNAPSHOT_FILE and config.MCTS_TREE == 'ismcts' and \
+            memory != None and turn == 1:
+        snapshots.append(takeSnapshot(agent.mcts))
+
+
+def _saveSnapshots(snapshots, logger):
+    if snapshots:
+        stored = saveSnapshot(config.MCTS_SNAPSHOT_FILE, snapshots)
+        logger.info('SAVED %d SNAPSHOTS (%d NODES IN FILE)', len(snapshots), stored)
+
+
 def playMatches(player1, player2, EPISODES, logger, turns_until_tau0, memory=None, goes_first=0):
 
-    env = Game()
+    # the Game deals once when built, then once per episode
+    env = Game(_deals(EPISODES + 1))
     scores = {player1.name: 0, "drawn": 0, player2.name: 0}
     sp_scores = {'sp': 0, "drawn": 0, 'nsp': 0}
     points = {player1.name: [], player2.name: []}
+    snapshots = []
 
     for e in range(EPISODES):
 
@@ -94,6 +154,7 @@ def playMatches(player1, player2, EPISODES, logger, turns_until_tau0, memory=Non
             else:
                 action, pi, MCTS_value, NN_value = players[state.playerTurn]['agent'].act(
                     state, 0)
+            _snapshot(players[state.playerTurn]['agent'], snapshots, memory, turn)
 
             if memory != None:
                 # Commit the move to memory
@@ -112,11 +173,19 @@ def playMatches(player1, player2, EPISODES, logger, turns_until_tau0, memory=Non
 
             # Do the action
             # the value of the newState from the POV of the new playerTurn i.e. -1 if the previous player played a winning move
+            mover = players[state.playerTurn]['agent']
             state, value, done, penalizeplayer = env.step(action)
 
+            if config.PONDER and done == 0 and players[state.playerTurn]['agent'] is not mover:
+                # think on the opponent's time
+                mover.ponder(state)
+
             # env.gameState.render(logger)
 
             if done == 1:
+                player1.stopPondering()
+                player2.stopPondering()
+
                 if memory != None:
                     # If the game is finished, assign the values correctly to the game moves
                     for move in memory.stmemory:
@@ -127,32 +196,128 @@ def playMatches(player1, player2, EPISODES, logger, turns_until_tau0, memory=Non
 
                     memory.commit_ltmemory()
 
-                if value == 1:
-                    logger.info('%s WINS!', players[state.playerTurn]['name'])
-                    scores[players[state.playerTurn]['name']
-                           ] = scores[players[state.playerTurn]['name']] + 1
-                    if state.playerTurn == 1:
-                        sp_scores['sp'] = sp_scores['sp'] + 1
-                    else:
-                        sp_scores['nsp'] = sp_scores['nsp'] + 1
-
-                elif value == -1:
-                    logger.info('%s WINS!', players[-state.playerTurn]['name'])
-                    scores[players[-state.playerTurn]['name']
-                           ] = scores[players[-state.playerTurn]['name']] + 1
-
-                    if state.playerTurn == 1:
-                        sp_scores['nsp'] = sp_scores['nsp'] + 1
-                    else:
-                        sp_scores['sp'] = sp_scores['sp'] + 1
-
-                else:
-                    logger.info('DRAW...')
-                    scores['drawn'] = scores['drawn'] + 1
-                    sp_scores['drawn'] = sp_scores['drawn'] + 1
-
-                pts = state.score
-                points[players[state.playerTurn]['name']].append(pts[0])
-                points[players[-state.playerTurn]['name']].append(pts[1])
+                _recordResult(state, value, players, logger, scores, sp_scores, points)
+
+    _saveSnapshots(snapshots, logger)
+    return (scores, memory, points, sp_scores)
+
+
+def playMatchesLockstep(player1, player2, EPISODES, logger, turns_until_tau0, memory=None,
+                        goes_first=0, games=config.LOCKSTEP_GAMES):
+    # playMatches with up to `games` games in flight at once, each with its
+    # own forked agents (see Agent.fork). Every round, each running game walks
+    # MCTS_BATCH_SIZE paths of the search for its current move; the leaves of
+    # all the games are then evaluated with one get_preds_batch call per
+    # agent, so the network sees batches of up to games * MCTS_BATCH_SIZE
+    # states. A game moves once its search has run the agent's
+    # MCTSsimulations (or solved the root), choosing as Agent.act does; the
+    # root-parallel, tree-parallel, gumbel and time/node budget options of
+    # act are not used; MCTS_MAX_NODES is enforced after every round, as
+    # Agent.search does after every batch. Returns what playMatches does.
+
+    scores = {player1.name: 0, "drawn": 0, player2.name: 0}
+    sp_scores = {'sp': 0, "drawn": 0, 'nsp': 0}
+    points = {player1.name: [], player2.name: []}
+
+    snapshots = []
+    started = 0
+    running = []
+    deals = _deals(EPISODES)
+
+    def newGame():
+        print (str(started) + ' ', end='')
+        logger.info('====================')
+        logger.info('EPISODE %d OF %d', started, EPISODES)
+        logger.info('====================')
+
+        # a new Game is dealt as it is built
+        env = Game(deals)
+        state = env.gameState
+
+        if goes_first == 0:
+            player1Starts = random.randint(0, 1) * 2 - 1
+        else:
+            player1Starts = goes_first
+        first, second = (player1, player2) if player1Starts == 1 else (player2, player1)
+
+        # self-play shares one agent, and so one tree, between both sides
+        forks = {first: first.fork()}
+        if second not in forks:
+            forks[second] = second.fork()
+        players = {1: {"agent": forks[first], "base": first, "name": first.name},
+                   -1: {"agent": forks[second], "base": second, "name": second.name}}
+        logger.info(first.name + ' plays as X')
+
+        return {'env': env, 'state': state, 'players': players, 'turn': 0,
+                'simulations': None, 'moves': Memory(config.MEMORY_SIZE)}
+
+    def searched(game):
+        agent = game['players'][game['state'].playerTurn]['agent']
+        return game['simulations'] >= agent.MCTSsimulations or agent.rootSolved()
+
+    while started < EPISODES or running:
+        while len(running) < games and started < EPISODES:
+            started += 1
+            running.append(newGame())
+
+        # walk every unfinished search, then evaluate all the leaves
+        pending = {}
+        for game in running:
+            player = game['players'][game['state'].playerTurn]
+            agent = player['agent']
+            if game['simulations'] is None:
+                agent.prepareTree(game['state'])
+                game['simulations'] = 0
+            if searched(game):
+                continue
+            batch = min(config.MCTS_BATCH_SIZE, agent.MCTSsimulations - game['simulations'])
+            paths, leaves = agent.walkPaths(batch)
+            game['simulations'] += batch
+            pending.setdefault(player['base'], []).append((agent, paths, leaves))
+
+        for base, searches in pending.items():
+            states = [agent.mcts.stateOf(leaf)
+                      for agent, _, leaves in searches for leaf in leaves]
+            preds = base.get_preds_batch(states) if states else []
+            for agent, paths, leaves in searches:
+                agent.backupPaths(paths, leaves, preds[:len(leaves)])
+                agent.mcts.enforceNodeCap(config.MCTS_MAX_NODES)
+                preds = preds[len(leaves):]
+
+        # games whose search is done make their move
+        for game in list(running):
+            if not searched(game):
+                continue
+            state = game['state']
+            players = game['players']
+            agent = players[state.playerTurn]['agent']
+
+            game['turn'] = game['turn'] + 1
+            tau = 1 if game['turn'] < turns_until_tau0 else 0
+            pi, values = agent.getAV(1, agent.mcts.rootStats())
+            action, value = agent.chooseAction(pi, values, tau)
+            action, pi, value = agent.playProvenWin(action, pi, value)
+            _snapshot(agent, snapshots, memory, game['turn'])
+
+            if memory != None:
+                game['moves'].commit_stmemory(game['env'].identities, state, pi)
+
+            state, value, done, _ = game['env'].step(action)
+            game['state'] = state
+            game['simulations'] = None
+
+            if done == 1:
+                running.remove(game)
+                if memory != None:
+                    for move in game['moves'].stmemory:
+                        if move['playerTurn'] == state.playerTurn:
+                            move['value'] = value
+                        else:
+                            move['value'] = -value
+                    memory.stmemory.extend(game['moves'].stmemory)
+                    memory.commit_ltmemory()
+
+                _recordResult(state, value, players, logger, scores, sp_scores, points)
 
+    _saveSnapshots(snapshots, logger)
     return (scores, memory, points, sp_scores)
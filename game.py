@@ -21,13 +21,175 @@ class Cards(Enum):
     EXPLODING_KITTEN = 15
 
 
+# Cards by value, for hot paths (Cards(value) is a slow enum lookup)
+CARDS = {card.value: card for card in Cards}
+
+# The deck and hands _initGameState deals, in game_config.json form, and the
+# cards by the ordinals deal_stream deals them as (exploding kitten last)
+GAME_CONFIG = {
+    'num_players': 2,
+    'num_cards_in_starting_hand': 4,
+    'num_defuse_cards_in_starting_hand': 1,
+    'num_defuse_cards': 2,
+    'num_attack_cards': 4,
+    'num_skip_cards': 4,
+    'num_favor_cards': 4,
+    'num_shuffle_cards': 4,
+    'num_cat1_cards': 4,
+    'num_cat2_cards': 4,
+    'num_cat3_cards': 4,
+    'num_cat4_cards': 4,
+    'num_cat5_cards': 4,
+}
+DEAL_CARDS = [CARDS[value] for value in range(Cards.NULL.value)] + [Cards.EXPLODING_KITTEN]
+
+
+def dealStream(batchSize, seed=None):
+    # initial deals for Game(deals=...), dealt batchSize at a time
+    from ExplodingKittensBatchGame import deal_stream
+    return deal_stream(GAME_CONFIG, batchSize, seed, kitten_on_top=False)
+
+# Zobrist keys for GameState.hash. A private generator keeps the keys fixed
+# across runs and leaves the game's own random stream untouched.
+_zobristRandom = random.Random(20240101)
+MAX_CARDS = 64
+NUM_CARD_VALUES = 17  # Cards values go up to 15; 16 stands for no card
+ZOBRIST_DECK = [[_zobristRandom.getrandbits(64) for _ in range(NUM_CARD_VALUES)]
+                for _ in range(MAX_CARDS)]
+ZOBRIST_DISCARD = [[_zobristRandom.getrandbits(64) for _ in range(NUM_CARD_VALUES)]
+                   for _ in range(MAX_CARDS)]
+# hands are keyed by the player holding them: ZOBRIST_HAND[player][cardType][count]
+ZOBRIST_HAND = {player: [[_zobristRandom.getrandbits(64) for _ in range(MAX_CARDS)]
+                         for _ in range(NUM_CARD_VALUES)]
+                for player in (1, -1)}
+ZOBRIST_LAST_PLAYED = [_zobristRandom.getrandbits(64)
+                       for _ in range(NUM_CARD_VALUES)]
+ZOBRIST_PLAYER = _zobristRandom.getrandbits(64)
+# card counts the current player can see but not the cards behind them, for
+# GameState.infoSetHash
+ZOBRIST_DECK_SIZE = [_zobristRandom.getrandbits(64) for _ in range(MAX_CARDS)]
+ZOBRIST_HAND_SIZE = [_zobristRandom.getrandbits(64) for _ in range(MAX_CARDS)]
+
+
+def _deckHash(deck):
+    h = 0
+    for position, card in enumerate(deck):
+        h ^= ZOBRIST_DECK[position][card.value]
+    return h
+
+
+def _discardHash(discard, start=0):
+    h = 0
+    for position in range(start, len(discard)):
+        h ^= ZOBRIST_DISCARD[position][discard[position].value]
+    return h
+
+
+def _handHash(hand, player):
+    keys = ZOBRIST_HAND[player]
+    h = 0
+    for cardType, numCards in enumerate(hand):
+        h ^= keys[cardType][numCards]
+    return h
+
+
+def _handHashUpdate(oldHand, newHand, player):
+    # XOR difference between the hashes of two versions of the same hand
+    keys = ZOBRIST_HAND[player]
+    h = 0
+    for cardType, numCards in enumerate(newHand):
+        if numCards != oldHand[cardType]:
+            h ^= keys[cardType][oldHand[cardType]] ^ keys[cardType][numCards]
+    return h
+
+
+def playout(state, heuristic=False, maxMoves=500):
+    # Play `state` out to the end and return its value for state's player to
+    # move (1 win, -1 loss, 0 if maxMoves runs out). Follows takeAction's
+    # rules, and draws the same random numbers in the same order, but works on
+    # plain lists of card values without building GameStates. Actions are
+    # random; with `heuristic` a player without a defuse plays an ATTACK or
+    # SKIP when they can instead of risking a draw.
+    if state.isEndGame:
+        # the game is already over, lost by the player to move
+        return -1
+
+    ATTACK, SKIP, SHUFFLE, FAVOR = (Cards.ATTACK.value, Cards.SKIP.value,
+                                    Cards.SHUFFLE.value, Cards.FAVOR.value)
+    NULL, EK = Cards.NULL.value, Cards.EXPLODING_KITTEN.value
+
+    deck = [card.value for card in state.deck]
+    currentHand = state.currentHand.copy()
+    opposingHand = state.opposingHand.copy()
+    lastPlayed = state.lastPlayedCard.value if state.lastPlayedCard != None else None
+    player = state.currentPlayer
+
+    for _ in range(maxMoves):
+        allowedActions = [NULL]
+        for cardType in range(1, len(currentHand)):
+            numCards = currentHand[cardType]
+            if cardType == ATTACK and lastPlayed == ATTACK:
+                continue
+            if (cardType < 5 and numCards >= 1) or numCards >= 2:
+                allowedActions.append(cardType)
+
+        if heuristic and currentHand[Cards.DEFUSE.value] == 0 and \
+                (ATTACK in allowedActions or SKIP in allowedActions):
+            action = ATTACK if ATTACK in allowedActions else SKIP
+        else:
+            action = random.choice(allowedActions)
+
+        noDrawThisTurn = False
+        if action != NULL:
+            currentHand[action] -= 1
+        if action == ATTACK or action == SKIP:
+            noDrawThisTurn = True
+        elif action == SHUFFLE:
+            random.shuffle(deck)
+        elif FAVOR <= action < NULL:
+            if action != FAVOR:
+                currentHand[action] -= 1
+            validActions = [cardType for cardType, numCards in enumerate(opposingHand)
+                            if numCards > 0]
+            if validActions:
+                chosenCard = validActions[random.randint(0, len(validActions)-1)]
+                currentHand[chosenCard] += 1
+                opposingHand[chosenCard] -= 1
+
+        isEndGame = False
+        if not noDrawThisTurn:
+            card = deck.pop()
+            if card != EK:
+                currentHand[card] += 1
+            elif currentHand[Cards.DEFUSE.value] != 0:
+                currentHand[Cards.DEFUSE.value] -= 1
+                if len(deck) == 0:
+                    deck.insert(0, EK)
+                else:
+                    deck.insert(random.randint(0, len(deck)-1), EK)
+            else:
+                isEndGame = True
+
+        if lastPlayed != ATTACK:
+            player = -player
+            currentHand, opposingHand = opposingHand, currentHand
+        lastPlayed = action
+
+        if isEndGame:
+            # as in takeAction, the state after the end is worth -1 to its player
+            return -1 if player == state.currentPlayer else 1
+    return 0
+
+
 class Game:
-    def __init__(self):
+    def __init__(self, deals=None):
+        # deals: an optional dealStream for new games to take their deal from
         # We need grid_shape
+        self.deals = deals
         self.currentPlayer = 1
         self.gameState = self._initGameState()
         self.actionSpace = np.array(
-            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0], dtype=np.int)
+            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0], dtype=int)
         self.name = 'exploding_kittens'
         self.state_size = len(self.gameState.binary)
         self.name = 'exploding_kittens'
@@ -36,6 +198,14 @@ class Game:
         self.input_shape = [len(self.gameState.binary)]
 
     def _initGameState(self):
+        if self.deals is not None:
+            deck, (hand1, hand2) = next(self.deals)
+            # each hand holds one defuse, whatever was dealt, as below
+            hand1[Cards.DEFUSE.value] = 1
+            hand2[Cards.DEFUSE.value] = 1
+            return GameState([DEAL_CARDS[card] for card in deck], hand1, hand2, [], None,
+                             self.currentPlayer)
+
         # Put all card in deck except E.K. and 2 defuse
         deck = [Cards.DEFUSE, Cards.DEFUSE,
                 Cards.ATTACK, Cards.ATTACK, Cards.ATTACK, Cards.ATTACK,
@@ -95,8 +265,21 @@ class Game:
         return identities
 
 
+class UndoToken():
+    # What GameState.apply changed, for GameState.undo, and what the move
+    # drew: `outcome` is its (event, position) pair in the format takeAction
+    # and apply accept, so the move can be replayed.
+    __slots__ = ['action', 'value', 'done', 'lastPlayedCard', 'currentPlayer', 'isEndGame',
+                 'deckHash', 'discardHash', 'handsHash', 'hash', 'allowed', 'discardSize',
+                 'event', 'drawn', 'position', 'oldDeck', 'swapped']
+
+    @property
+    def outcome(self):
+        return (self.event, self.position)
+
+
 class GameState():
-    def __init__(self, deck, currentHand, opposingHand, discard, lastPlayedCard, currentPlayer):
+    def __init__(self, deck, currentHand, opposingHand, discard, lastPlayedCard, currentPlayer, hashes=None):
         self.deck = deck
         self.currentHand = currentHand
         self.opposingHand = opposingHand
@@ -108,11 +291,51 @@ class GameState():
         self.noDrawThisTurn = False
         self.numAttacks = 0
         self.isEndGame = False
-        self.binary = np.array(self._binary())
-        self.id = self._convertStateToId()
-        self.allowedActions = self._allowedActions()
-        self.value = self._getValue()
-        self.score = self._getScore()
+        # derived fields, built on first use (most search states never need
+        # their encoding or readable id)
+        self._id = None
+        self._binaryArray = None
+        self._allowed = None
+        self._value = None
+        self._score = None
+
+        # Zobrist hash of (deck, discard, both hands, last played card, player
+        # to move), used as the search tree key. takeAction passes the deck,
+        # discard and hand components on so children update them incrementally.
+        if hashes is None:
+            hashes = (_deckHash(deck), _discardHash(discard),
+                      _handHash(currentHand, currentPlayer) ^ _handHash(opposingHand, -currentPlayer))
+        self._deckHash, self._discardHash, self._handsHash = hashes
+        self.hash = self._deckHash ^ self._discardHash ^ self._handsHash ^ \
+            ZOBRIST_LAST_PLAYED[lastPlayedCard.value if lastPlayedCard != None else 16]
+        if currentPlayer == -1:
+            self.hash ^= ZOBRIST_PLAYER
+
+    @property
+    def binary(self):
+        if self._binaryArray is None:
+            self._binaryArray = np.array(self._binary())
+        return self._binaryArray
+
+    @property
+    def allowedActions(self):
+        if self._allowed is None:
+            self._allowed = self._allowedActions()
+        return self._allowed
+
+    # value and score depend on isEndGame, which takeAction sets after
+    # construction
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = self._getValue()
+        return self._value
+
+    @property
+    def score(self):
+        if self._score is None:
+            self._score = self._getScore()
+        return self._score
 
     def _allowedActions(self):
         allowedActions = [10]
@@ -144,7 +367,8 @@ class GameState():
 
     # End the turn by drawing a card. Don't draw if noDrawThisTurn (i.e. an attack or skip was played)
     # Returns whether the game ended due to an exploding kitten or not
-    def _endTurn(self, newDeck, newCurrentHand, noDrawThisTurn):
+    # `position` fixes where a defused E.K. goes back into the deck (random if None)
+    def _endTurn(self, newDeck, newCurrentHand, noDrawThisTurn, position=None):
         if noDrawThisTurn:
             return False, newDeck, newCurrentHand
         card = newDeck.pop()
@@ -157,7 +381,8 @@ class GameState():
                 if len(newDeck) == 0:
                     newDeck.insert(0, Cards.EXPLODING_KITTEN)
                 else:
-                    position = random.randint(0, len(newDeck)-1)
+                    if position is None:
+                        position = random.randint(0, len(newDeck)-1)
                     newDeck.insert(position, Cards.EXPLODING_KITTEN)
             else:
                 # EndGame
@@ -176,6 +401,59 @@ class GameState():
 
     #     return id
 
+    @property
+    def id(self):
+        # readable id, only built on demand (the search keys on self.hash)
+        if self._id is None:
+            self._id = self._convertStateToId()
+        return self._id
+
+    def infoSetHash(self, player):
+        # Hash of what `player` knows: their own hand, the discard pile, the last
+        # played card, the player to move and how many cards the deck and the
+        # other hand hold. States differing only in deck order or in the other
+        # player's cards share it.
+        if player == self.currentPlayer:
+            hand, otherHand = self.currentHand, self.opposingHand
+        else:
+            hand, otherHand = self.opposingHand, self.currentHand
+        h = self._discardHash ^ _handHash(hand, player) ^ \
+            ZOBRIST_LAST_PLAYED[self.lastPlayedCard.value if self.lastPlayedCard != None else 16] ^ \
+            ZOBRIST_DECK_SIZE[len(self.deck)] ^ ZOBRIST_HAND_SIZE[sum(otherHand)]
+        if self.currentPlayer == -1:
+            h ^= ZOBRIST_PLAYER
+        return h
+
+    def determinize(self, player):
+        # A random state with the same infoSetHash(player): the cards `player`
+        # has not seen (the deck and the other hand) are dealt again, keeping
+        # the deck and hand sizes. E.K.s can only be in the deck.
+        if player == self.currentPlayer:
+            hand, otherHand = self.currentHand, self.opposingHand
+        else:
+            hand, otherHand = self.opposingHand, self.currentHand
+
+        unseen = [card for card in self.deck if card != Cards.EXPLODING_KITTEN]
+        for cardType, numCards in enumerate(otherHand):
+            unseen += [Cards(cardType)] * numCards
+        random.shuffle(unseen)
+
+        handSize = sum(otherHand)
+        newOtherHand = [0] * len(otherHand)
+        for card in unseen[:handSize]:
+            newOtherHand[card.value] += 1
+
+        deck = unseen[handSize:]
+        for _ in range(len(self.deck) - len(deck)):
+            deck.insert(random.randint(0, len(deck)), Cards.EXPLODING_KITTEN)
+
+        if player == self.currentPlayer:
+            currentHand, opposingHand = hand.copy(), newOtherHand
+        else:
+            currentHand, opposingHand = newOtherHand, hand.copy()
+        return GameState(deck, currentHand, opposingHand, self.discard.copy(),
+                         self.lastPlayedCard, self.currentPlayer)
+
     def _convertStateToId(self):
         state = self.deck.copy()
         state.append(self.discard.copy())
@@ -197,11 +475,14 @@ class GameState():
         tmp = self._getValue()
         return (tmp[1], tmp[2])
 
-    def takeAction(self, action):
+    # `outcome` fixes the random events of the action instead of drawing them,
+    # as an (event, position) pair from chanceOutcomes: event is the shuffled
+    # deck for SHUFFLE or the stolen card type for FAVOR/CAT, position is where
+    # a defused E.K. is put back. None plays the action with random events.
+    def takeAction(self, action, outcome=None):
         # I'm unsure if the allowedActions() function completely eliminates actions. If it does
         # then the self.currentHand[action]>0 case is covered, if not then we need to check
         # for it again here.
-        self.allowedActions = self._allowedActions()
         if action not in self.allowedActions:
             return (self, self.value, self.isEndGame, self.currentPlayer, self.currentPlayer)
 
@@ -220,12 +501,17 @@ class GameState():
             newDiscard.append(card)
 
         noDrawThisTurn = False
+        deckReordered = False
         if card == Cards.ATTACK:
             noDrawThisTurn = True
         elif card == Cards.SKIP:
             noDrawThisTurn = True
         elif card == Cards.SHUFFLE:
-            random.shuffle(newDeck)
+            if outcome is not None:
+                newDeck = list(outcome[0])
+            else:
+                random.shuffle(newDeck)
+            deckReordered = True
         elif (card == Cards.FAVOR) or (card == Cards.CAT1) or (card == Cards.CAT2) or (card == Cards.CAT3) or (card == Cards.CAT4) or (card == Cards.CAT5):
 
             # Take 2 cards from hand if a cat card was played
@@ -239,15 +525,37 @@ class GameState():
                     validActions.append(cardType)
 
             if validActions:
-                action = random.randint(0, len(validActions)-1)
-                chosenCard = validActions[action]
+                if outcome is not None:
+                    chosenCard = outcome[0]
+                else:
+                    action = random.randint(0, len(validActions)-1)
+                    chosenCard = validActions[action]
 
                 newCurrentHand[chosenCard] += 1
                 newOpposingHand[chosenCard] -= 1
 
         # Done taking actions, end turn by drawing a card and checking if the game ends
         isEndGame, newDeck, newCurrentHand = self._endTurn(
-            newDeck, newCurrentHand, noDrawThisTurn)
+            newDeck, newCurrentHand, noDrawThisTurn,
+            outcome[1] if outcome is not None else None)
+
+        # Update the hash components. The deck is only rehashed in full when
+        # it was shuffled or had the exploding kitten put back into it.
+        if deckReordered:
+            deckHash = _deckHash(newDeck)
+        elif noDrawThisTurn:
+            deckHash = self._deckHash
+        elif len(newDeck) < len(self.deck):
+            position = len(newDeck)
+            deckHash = self._deckHash ^ \
+                ZOBRIST_DECK[position][self.deck[position].value]
+        else:
+            deckHash = _deckHash(newDeck)
+        hashes = (deckHash,
+                  self._discardHash ^ _discardHash(newDiscard, len(self.discard)),
+                  self._handsHash ^
+                  _handHashUpdate(self.currentHand, newCurrentHand, self.currentPlayer) ^
+                  _handHashUpdate(self.opposingHand, newOpposingHand, -self.currentPlayer))
 
         if self.lastPlayedCard == Cards.ATTACK:
             # Set the next players turn equal to the current players turn
@@ -260,11 +568,11 @@ class GameState():
             # Otherwise the state reverses
             nextPlayer = self.currentPlayer
             newState = GameState(newDeck, newCurrentHand,
-                                 newOpposingHand, newDiscard, card, nextPlayer)
+                                 newOpposingHand, newDiscard, card, nextPlayer, hashes)
         else:
             nextPlayer = -self.currentPlayer
             newState = GameState(newDeck, newOpposingHand,
-                                 newCurrentHand, newDiscard, card, nextPlayer)
+                                 newCurrentHand, newDiscard, card, nextPlayer, hashes)
 
         # # ???? Shouldn't the state reverse based on whether an attack card was played last?
         # if self.currentPlayer == 1:
@@ -282,19 +590,236 @@ class GameState():
             done = 1
         return (newState, value, done, self.currentPlayer, nextPlayer)
 
-    def T(self, action, newState):
-        # state: [currentHand, lastPlayedCard, cardsInDeck]
-        # newState: [opposingHand, card, cardsInDeck-1]
-        card = Cards(action)
+    def copy(self):
+        # a state with its own deck, discard and hands, for apply/undo walks
+        state = GameState(self.deck.copy(), self.currentHand.copy(), self.opposingHand.copy(),
+                          self.discard.copy(), self.lastPlayedCard, self.currentPlayer,
+                          (self._deckHash, self._discardHash, self._handsHash))
+        state.isEndGame = self.isEndGame
+        return state
+
+    def apply(self, action, outcome=None):
+        # takeAction(action, outcome) in place: this state becomes the one
+        # takeAction would return, drawing the same random events from the
+        # same random calls, and an UndoToken is returned for undo(). Nothing
+        # is copied except the deck order around a SHUFFLE. token.value and
+        # token.done are takeAction's. An action that is not allowed leaves
+        # the state as it is and returns None.
+        if action not in self.allowedActions:
+            return None
+
+        card = CARDS[action]
+        player = self.currentPlayer
+        hand, otherHand, deck, discard = self.currentHand, self.opposingHand, self.deck, self.discard
+        keys = ZOBRIST_HAND[player]
+        deckHash, discardHash, handsHash = self._deckHash, self._discardHash, self._handsHash
+
+        token = UndoToken()
+        token.action = action
+        token.lastPlayedCard = self.lastPlayedCard
+        token.currentPlayer = player
+        token.isEndGame = self.isEndGame
+        token.deckHash, token.discardHash, token.handsHash = deckHash, discardHash, handsHash
+        token.hash = self.hash
+        token.allowed = self._allowed
+        token.discardSize = len(discard)
+        token.event = token.drawn = token.position = token.oldDeck = None
+
+        isCat = Cards.CAT1.value <= action <= Cards.CAT5.value
         if card != Cards.NULL:
-            cardDrawn = self.deck[-1]
-            count = self.deck.count(cardDrawn)
-            transition_prob = float(count) / len(self.deck)
+            # a CAT is played as a pair
+            played = 2 if isCat else 1
+            handsHash ^= keys[action][hand[action]] ^ keys[action][hand[action] - played]
+            hand[action] -= played
+            for _ in range(played):
+                discardHash ^= ZOBRIST_DISCARD[len(discard)][action]
+                discard.append(card)
+
+        noDrawThisTurn = card == Cards.ATTACK or card == Cards.SKIP
+        deckReordered = False
+        if card == Cards.SHUFFLE:
+            token.oldDeck = deck
+            if outcome is not None:
+                deck = list(outcome[0])
+            else:
+                deck = deck.copy()
+                random.shuffle(deck)
+            self.deck = deck
+            token.event = tuple(deck)
+            deckReordered = True
+        elif card == Cards.FAVOR or isCat:
+            validActions = [cardType for cardType, numCards in enumerate(otherHand) if numCards > 0]
+            if validActions:
+                if outcome is not None:
+                    chosenCard = outcome[0]
+                else:
+                    chosenCard = validActions[random.randint(0, len(validActions)-1)]
+                otherKeys = ZOBRIST_HAND[-player][chosenCard]
+                handsHash ^= keys[chosenCard][hand[chosenCard]] ^ keys[chosenCard][hand[chosenCard] + 1] ^ \
+                    otherKeys[otherHand[chosenCard]] ^ otherKeys[otherHand[chosenCard] - 1]
+                hand[chosenCard] += 1
+                otherHand[chosenCard] -= 1
+                token.event = chosenCard
+
+        # end the turn as _endTurn does
+        isEndGame = False
+        if not noDrawThisTurn:
+            drawn = token.drawn = deck.pop()
+            if drawn == Cards.EXPLODING_KITTEN:
+                defuse = Cards.DEFUSE.value
+                if hand[defuse] != 0:
+                    handsHash ^= keys[defuse][hand[defuse]] ^ keys[defuse][hand[defuse] - 1]
+                    hand[defuse] -= 1
+                    if len(deck) == 0:
+                        position = 0
+                    elif outcome is not None and outcome[1] is not None:
+                        position = outcome[1]
+                    else:
+                        position = random.randint(0, len(deck)-1)
+                    deck.insert(position, drawn)
+                    token.position = position
+                    deckReordered = True
+                else:
+                    isEndGame = True
+            else:
+                drawnType = drawn.value
+                handsHash ^= keys[drawnType][hand[drawnType]] ^ keys[drawnType][hand[drawnType] + 1]
+                hand[drawnType] += 1
+
+        if deckReordered:
+            deckHash = _deckHash(deck)
+        elif not noDrawThisTurn:
+            deckHash ^= ZOBRIST_DECK[len(deck)][token.drawn.value]
+
+        # after an attack the same player moves again, otherwise the hands
+        # swap places as in takeAction
+        token.swapped = self.lastPlayedCard != Cards.ATTACK
+        if token.swapped:
+            self.currentHand, self.opposingHand = otherHand, hand
+            self.currentPlayer = -player
+        self.playerTurn = self.currentPlayer
+        self.lastPlayedCard = card
+        self.isEndGame = isEndGame
+
+        self._deckHash, self._discardHash, self._handsHash = deckHash, discardHash, handsHash
+        self.hash = deckHash ^ discardHash ^ handsHash ^ ZOBRIST_LAST_PLAYED[action]
+        if self.currentPlayer == -1:
+            self.hash ^= ZOBRIST_PLAYER
+        self._id = self._binaryArray = self._allowed = self._value = self._score = None
+
+        token.value = -1 if isEndGame else 0
+        token.done = 1 if isEndGame else 0
+        return token
+
+    def undo(self, token):
+        # reverse the apply that returned `token`, which must be this state's
+        # most recent one not yet undone
+        if token.swapped:
+            self.currentHand, self.opposingHand = self.opposingHand, self.currentHand
+        hand, otherHand, deck = self.currentHand, self.opposingHand, self.deck
+
+        drawn = token.drawn
+        if drawn is not None:
+            if token.position is not None:
+                del deck[token.position]
+                hand[Cards.DEFUSE.value] += 1
+            elif drawn != Cards.EXPLODING_KITTEN:
+                hand[drawn.value] -= 1
+            deck.append(drawn)
+        if token.oldDeck is not None:
+            self.deck = token.oldDeck
+        elif token.event is not None:
+            # a steal
+            hand[token.event] -= 1
+            otherHand[token.event] += 1
+        discard = self.discard
+        while len(discard) > token.discardSize:
+            hand[discard.pop().value] += 1
+
+        self.lastPlayedCard = token.lastPlayedCard
+        self.currentPlayer = self.playerTurn = token.currentPlayer
+        self.isEndGame = token.isEndGame
+        self._deckHash, self._discardHash, self._handsHash = \
+            token.deckHash, token.discardHash, token.handsHash
+        self.hash = token.hash
+        self._allowed = token.allowed
+        self._id = self._binaryArray = self._value = self._score = None
+
+    def chanceOutcomes(self, action, shuffleSamples):
+        # The random events behind takeAction(action) as a list of
+        # (probability, outcome) pairs to pass back to takeAction, or None if
+        # the action is deterministic. Draws come off the top of the known deck,
+        # so the events are: which card a FAVOR/CAT steals (uniform over the
+        # card types the opponent holds), where a defused E.K. is put back
+        # (uniform over the deck) and the order a SHUFFLE leaves. Orders cannot
+        # be enumerated, so `shuffleSamples` random ones stand in for them with
+        # equal probability.
+        if action not in self.allowedActions:
+            return None
+        card = Cards(action)
+
+        if card == Cards.SHUFFLE:
+            events = []
+            for _ in range(shuffleSamples):
+                deck = self.deck.copy()
+                random.shuffle(deck)
+                events.append((1.0 / shuffleSamples, deck))
+        elif card in (Cards.FAVOR, Cards.CAT1, Cards.CAT2, Cards.CAT3, Cards.CAT4, Cards.CAT5):
+            stealable = [cardType for cardType, numCards in enumerate(self.opposingHand)
+                         if numCards > 0]
+            events = [(1.0 / len(stealable), cardType) for cardType in stealable] \
+                or [(1.0, None)]
         else:
-            transition_prob = 1.0
+            events = [(1.0, None)]
+
+        noDrawThisTurn = card in (Cards.ATTACK, Cards.SKIP)
+        outcomes = []
+        for prob, event in events:
+            deck = event if card == Cards.SHUFFLE else self.deck
+            defuses = self.currentHand[Cards.DEFUSE.value]
+            if card != Cards.SHUFFLE and event == Cards.DEFUSE.value:
+                defuses += 1
+            # cards left once the E.K. is drawn, i.e. the reinsertion positions
+            remaining = len(deck) - 1
+            if not noDrawThisTurn and deck[-1] == Cards.EXPLODING_KITTEN and \
+                    defuses > 0 and remaining > 0:
+                outcomes += [(prob / remaining, (event, position))
+                             for position in range(remaining)]
+            else:
+                outcomes.append((prob, (event, None)))
+
+        if len(outcomes) == 1:
+            return None
+        return outcomes
 
-        # transition_probability = 1.0 / NUM_CARDS
-        return transition_prob
+    def isDeterministic(self, action):
+        # Whether takeAction(action) has a single outcome, i.e. chanceOutcomes
+        # would return None, decided without sampling any shuffles
+        if action not in self.allowedActions:
+            return True
+        card = Cards(action)
+        if card == Cards.SHUFFLE:
+            return False
+        if card in (Cards.ATTACK, Cards.SKIP):
+            return True
+
+        defuses = self.currentHand[Cards.DEFUSE.value]
+        if card in (Cards.FAVOR, Cards.CAT1, Cards.CAT2, Cards.CAT3, Cards.CAT4, Cards.CAT5):
+            stealable = [cardType for cardType, numCards in enumerate(self.opposingHand)
+                         if numCards > 0]
+            if len(stealable) > 1:
+                return False
+            if stealable == [Cards.DEFUSE.value]:
+                defuses += 1
+        # a defused E.K. can go back anywhere in what is left of the deck
+        return not (self.deck[-1] == Cards.EXPLODING_KITTEN and defuses > 0 and len(self.deck) > 2)
+
+    def T(self, action, newState, shuffleSamples=100):
+        # Probability that takeAction(action) leads to newState. Shuffles are
+        # estimated from sampled orders (see chanceOutcomes).
+        outcomes = self.chanceOutcomes(action, shuffleSamples) or [(1.0, None)]
+        return sum(prob for prob, outcome in outcomes
+                   if self.takeAction(action, outcome)[0].hash == newState.hash)
 
 
 '''
@@ -36,10 +36,17 @@ class PlayerState:
 def isCatCard(value):
     return True if (value > 4 and value < 10) else False
 
+# Cards by the ordinals ExplodingKittensBatchGame.deal_stream deals them as
+DEAL_CARDS = [Cards(value) for value in range(10)] + [Cards.EXPLODING_KITTEN]
+
 class EKGameV0(gym.Env):
-    def __init__(self, config_file=None, debug=False):
+    def __init__(self, config_file=None, debug=False, deals=None):
         super(EKGameV0, self).__init__()
 
+        # deals: an optional stream of initial deals for reset to take, as
+        # deal_stream(game_config, batch_size, kitten_on_top=False)
+        self.deals = deals
+
         if config_file is None:
             config_file = None
         else:
@@ -69,6 +76,14 @@ class EKGameV0(gym.Env):
         self.reset()
 
     def reset(self, seed=None):
+        if self.deals is not None:
+            deck, (hand1, hand2) = next(self.deals)
+            deck = [DEAL_CARDS[card] for card in deck]
+            players = [PlayerState(hand1), PlayerState(hand2)]
+            self.gameState = ExplodingKittensGameState(deck, players, self.playerId, self.debug)
+            self.STARTING_DECK_SIZE = len(deck)
+            return (self.observation, {})
+
         # Put all card in deck except E.K. and 2 defuse cards        
         deck = [Cards.DEFUSE] * self.game_config["num_defuse_cards"] \
                 + [Cards.ATTACK] * self.game_config["num_attack_cards"] \
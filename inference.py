@@ -0,0 +1,222 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class InferenceQueue():
+    # Collects model inputs from many threads and runs them through predict in
+    # batches. Whichever thread owns the model calls serve(); submitters block
+    # on the returned Future.
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def submit(self, inputToModel):
+        future = Future()
+        self._queue.put((inputToModel, future))
+        return future
+
+    def serve(self, predict, maxBatchSize, timeout):
+        # Wait up to `timeout` seconds for a first request, then keep taking
+        # requests until the batch is full or `timeout` has passed since the
+        # first one arrived. Returns the number of requests served.
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return 0
+
+        deadline = time.perf_counter() + timeout
+        while len(batch) < maxBatchSize:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0)))
+            except queue.Empty:
+                break
+
+        try:
+            preds = predict(np.array([inputToModel for inputToModel, _ in batch]))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return len(batch)
+
+        # each future gets its own row of every model output
+        for i, (_, future) in enumerate(batch):
+            future.set_result(tuple(output[i] for output in preds))
+        return len(batch)
+
+
+class EvaluationCache():
+    # LRU cache of model outputs keyed by the model input. Entries belong to
+    # one model version: a lookup with another version empties the cache
+    # first, so outputs never outlive the weights that produced them.
+    # maxSize = 0 turns the cache off.
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _setVersion(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    def get(self, inputToModel, version):
+        # the cached outputs for inputToModel, or None
+        if not self.maxSize:
+            return None
+        self._setVersion(version)
+        key = inputToModel.tobytes()
+        outputs = self._entries.get(key)
+        if outputs is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return outputs
+
+    def put(self, inputToModel, version, outputs):
+        if not self.maxSize:
+            return
+        self._setVersion(version)
+        key = inputToModel.tobytes()
+        self._entries[key] = outputs
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxSize:
+            self._entries.popitem(last=False)
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class InferenceServer():
+    # One model executor shared by any number of agents and threads.
+    # predict(model, inputs) queues the rows and returns a Future; a
+    # background thread groups the waiting requests by model and weights
+    # version (so best and current never share a batch) and runs a group
+    # through model.predict once it holds maxBatchSize rows, its oldest
+    # request has waited maxLatency seconds, or no more requests can come.
+    # Each Future gets its own rows of every model output.
+    #
+    # Submitters that run alongside each other (agents acting in different
+    # threads) each hold a session() while they act. Once every session
+    # holder has a request waiting there is nobody left to wait for, so the
+    # waiting requests are served at once; with no sessions open, requests
+    # are served as soon as the queue is empty. Either way a lone submitter
+    # never waits out maxLatency, and requests that arrive while a batch is
+    # running still share the next one.
+    #
+    # Models run on the server thread while their owners may predict too, so
+    # they should have had prepareThreads called by the thread that built
+    # them (Agent does this when given a server).
+
+    def __init__(self, maxBatchSize, maxLatency):
+        self.maxBatchSize = maxBatchSize
+        self.maxLatency = maxLatency
+        self.batches = 0
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._sessions = 0
+        self._sessionLock = threading.Lock()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        # serve what is still waiting, then end the server thread
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def predict(self, model, inputs):
+        future = Future()
+        self._queue.put((model, model.version, np.asarray(inputs), future))
+        return future
+
+    @contextmanager
+    def session(self):
+        # held by a submitter for as long as it may send requests that others
+        # could usefully wait for
+        with self._sessionLock:
+            self._sessions += 1
+        try:
+            yield self
+        finally:
+            with self._sessionLock:
+                self._sessions -= 1
+            # the requests waiting may no longer have anyone to wait for
+            self._queue.put(False)
+
+    def meanBatchSize(self):
+        return self.rows / self.batches if self.batches else 0.0
+
+    def _run(self):
+        pending = {}  # (model, version) -> [deadline, rows, requests]
+        while True:
+            timeout = None
+            if pending:
+                deadline = min(group[0] for group in pending.values())
+                timeout = max(deadline - time.perf_counter(), 0)
+            try:
+                requests = [self._queue.get(timeout=timeout)]
+            except queue.Empty:
+                requests = []
+            # and everything else already queued
+            while True:
+                try:
+                    requests.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = None in requests
+            for request in requests:
+                if request:
+                    model, version, inputs, _ = request
+                    group = pending.setdefault(
+                        (id(model), version), [time.perf_counter() + self.maxLatency, 0, []])
+                    group[1] += len(inputs)
+                    group[2].append(request)
+
+            now = time.perf_counter()
+            waiting = sum(len(group[2]) for group in pending.values())
+            nobodyElse = waiting >= self._sessions
+            for key, (deadline, rows, requests) in list(pending.items()):
+                if stopping or nobodyElse or rows >= self.maxBatchSize or now >= deadline:
+                    del pending[key]
+                    self._serve(requests)
+            if stopping:
+                return
+
+    def _serve(self, requests):
+        model = requests[0][0]
+        inputs = np.concatenate([inputs for _, _, inputs, _ in requests])
+        try:
+            preds = model.predict(inputs)
+        except Exception as e:
+            for _, _, _, future in requests:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.rows += len(inputs)
+        start = 0
+        for _, _, inputs, future in requests:
+            future.set_result([output[start:start + len(inputs)] for output in preds])
+            start += len(inputs)
@@ -13,9 +13,10 @@ from keras.utils import plot_model
 
 from game import Game, GameState
 from agent import Agent
+from inference import InferenceServer
 from memory import Memory
 from model import Densely_connected_net
-from funcs import playMatches, playMatchesBetweenVersions
+from funcs import playMatches, playMatchesBetweenVersions, playMatchesLockstep
 
 import loggers as lg
 
@@ -55,12 +56,12 @@ if initialise.INITIAL_MODEL_VERSION != None:
     best_player_version  = initialise.INITIAL_MODEL_VERSION
     print('LOADING MODEL VERSION ' + str(initialise.INITIAL_MODEL_VERSION) + '...')
     m_tmp = best_NN.read(env.name, initialise.INITIAL_RUN_NUMBER, best_player_version)
-    current_NN.model.set_weights(m_tmp.get_weights())
-    best_NN.model.set_weights(m_tmp.get_weights())
+    current_NN.set_weights(m_tmp.get_weights())
+    best_NN.set_weights(m_tmp.get_weights())
 #otherwise just ensure the weights on the two players are the same
 else:
     best_player_version = 0
-    best_NN.model.set_weights(current_NN.model.get_weights())
+    best_NN.set_weights(current_NN.get_weights())
 
 #copy the config file to the run folder
 copyfile('./config.py', run_folder + 'config.py')
@@ -70,8 +71,12 @@ print('\n')
 
 ######## CREATE THE PLAYERS ########
 
-current_player = Agent('current_player', env.state_size, env.action_size, config.MCTS_SIMS, config.CPUCT, current_NN)
-best_player = Agent('best_player', env.state_size, env.action_size, config.MCTS_SIMS, config.CPUCT, best_NN)
+# one batching executor for both players' models, if configured
+server = InferenceServer(config.INFERENCE_BATCH_SIZE, config.INFERENCE_MAX_LATENCY).start() \
+    if config.INFERENCE_SERVER else None
+
+current_player = Agent('current_player', env.state_size, env.action_size, config.MCTS_SIMS, config.CPUCT, current_NN, server=server)
+best_player = Agent('best_player', env.state_size, env.action_size, config.MCTS_SIMS, config.CPUCT, best_NN, server=server)
 #user_player = User('player1', env.state_size, env.action_size)
 iteration = 0
 
@@ -88,7 +93,9 @@ while 1:
 
     ######## SELF PLAY ########
     print('SELF PLAYING ' + str(config.EPISODES) + ' EPISODES...')
-    _, memory, _, _ = playMatches(best_player, best_player, config.EPISODES, lg.logger_main, turns_until_tau0 = config.TURNS_UNTIL_TAU0, memory = memory)
+    # with LOCKSTEP_GAMES > 1 the games run side by side, sharing predict calls
+    play = playMatchesLockstep if config.LOCKSTEP_GAMES > 1 else playMatches
+    _, memory, _, _ = play(best_player, best_player, config.EPISODES, lg.logger_main, turns_until_tau0 = config.TURNS_UNTIL_TAU0, memory = memory)
     print('\n')
 
     memory.clear_stmemory()
@@ -124,9 +131,12 @@ while 1:
 
             # s['state'].render(lg.logger_memory)
 
+        lg.logger_memory.info('EVAL CACHE HIT RATE: CURRENT %.2f, BEST %.2f',
+                              current_player.evalCache.hitRate(), best_player.evalCache.hitRate())
+
         ######## TOURNAMENT ########
         print('TOURNAMENT...')
-        scores, _, points, sp_scores = playMatches(best_player, current_player, config.EVAL_EPISODES, lg.logger_tourney, turns_until_tau0 = 0, memory = None)
+        scores, _, points, sp_scores = play(best_player, current_player, config.EVAL_EPISODES, lg.logger_tourney, turns_until_tau0 = 0, memory = None)
         print('\nSCORES')
         print(scores)
         print('\nSTARTING PLAYER / NON-STARTING PLAYER SCORES')
@@ -137,7 +147,7 @@ while 1:
 
         if scores['current_player'] > scores['best_player'] * config.SCORING_THRESHOLD:
             best_player_version = best_player_version + 1
-            best_NN.model.set_weights(current_NN.model.get_weights())
+            best_NN.set_weights(current_NN.get_weights())
             best_NN.write(env.name, best_player_version)
 
     else:
@@ -1,6 +1,7 @@
 # %matplotlib inline
 
 import logging
+import threading
 import config
 import numpy as np
 
@@ -19,18 +20,120 @@ import keras.backend as K
 
 from settings import run_folder, run_archive_folder
 
+class DenseInference():
+	# Forward pass of a model built only from Dense layers (a trunk feeding a
+	# 'value_head' and a 'policy_head', like Densely_connected_net) in plain
+	# NumPy, without Keras' per-call overhead. It holds a copy of the weights
+	# at the time it was built.
+	ACTIVATIONS = {'relu': lambda x: np.maximum(x, 0), 'tanh': np.tanh, 'linear': lambda x: x}
+
+	def __init__(self, model):
+		self.trunk = []
+		self.heads = {}
+		for layer in model.layers:
+			if not isinstance(layer, Dense):
+				continue
+			weights = layer.get_weights()
+			bias = weights[1].astype(np.float32) if len(weights) > 1 else None
+			dense = (weights[0].astype(np.float32), bias, self.ACTIVATIONS[layer.get_config()['activation']])
+			if layer.name in ('value_head', 'policy_head'):
+				self.heads[layer.name] = dense
+			else:
+				self.trunk.append(dense)
+
+	@staticmethod
+	def _dense(x, dense):
+		W, b, activation = dense
+		y = x @ W
+		if b is not None:
+			y += b
+		return activation(y)
+
+	def predict(self, x):
+		# [values (n, 1), policy logits (n, actions)], like Keras; a single
+		# input without the batch axis counts as a batch of one
+		x = np.asarray(x, dtype=np.float32)
+		x = x.reshape(1 if x.ndim == 1 else len(x), -1)
+		for dense in self.trunk:
+			x = self._dense(x, dense)
+		return [self._dense(x, self.heads['value_head']), self._dense(x, self.heads['policy_head'])]
+
+
 class Gen_Model():
+	# models that DenseInference can run set this
+	numpyInference = False
+
 	def __init__(self, reg_const, learning_rate, input_dim, output_dim):
 		self.reg_const = reg_const
 		self.learning_rate = learning_rate
 		self.input_dim = input_dim
 		self.output_dim = output_dim
+		# bumped whenever the weights change, so cached predictions can be dropped
+		self.version = 0
+		# NumPy forward pass and the version it was built for
+		self.inference = None
+		self.inferenceVersion = None
+		# graph of the model whose predict function prepareThreads built
+		self.graph = None
+		self.preparedModel = None
+		self.predictLock = threading.RLock()
+
+	def prepareThreads(self):
+		# Keras (2.1 on TF 1.x) builds a model's predict function the first
+		# time it predicts, which is not thread-safe, and a thread other than
+		# the one that built the model only sees the model's graph inside
+		# graph.as_default(). Build the function now and note the graph, so
+		# predict can be called from pondering and inference server threads.
+		# Called by the thread that owns the model once it is built; predict
+		# falls back to it, under a lock, for models swapped in later.
+		with self.predictLock:
+			if self.preparedModel is not self.model:
+				self.model._make_predict_function()
+				self.graph = K.get_session().graph
+				self.preparedModel = self.model
+
+	def _kerasPredict(self, x):
+		if self.preparedModel is not self.model:
+			self.prepareThreads()
+		with self.graph.as_default():
+			return self.model.predict(x)
 
 	def predict(self, x):
-		return self.model.predict(x)
+		if config.NUMPY_INFERENCE and self.numpyInference:
+			if self.inferenceVersion != self.version:
+				with self.predictLock:
+					if self.inferenceVersion != self.version:
+						self._refreshInference()
+			if self.inference is not None:
+				return self.inference.predict(x)
+		return self._kerasPredict(x)
+
+	def _refreshInference(self):
+		# Rebuild the NumPy forward pass from the current weights and check it
+		# against Keras on a random batch; on a mismatch this version of the
+		# weights is left to Keras.
+		self.inferenceVersion = self.version
+		self.inference = DenseInference(self.model)
+
+		probe = np.random.RandomState(0).uniform(0, 4, [8] + list(self.input_dim)).astype(np.float32)
+		for expected, actual in zip(self._kerasPredict(probe), self.inference.predict(probe)):
+			if not np.allclose(expected, actual, rtol=1e-4, atol=1e-5):
+				lg.logger_model.warning('NUMPY INFERENCE DOES NOT MATCH KERAS (MAX DIFF %f), USING KERAS',
+					np.max(np.abs(expected - actual)))
+				self.inference = None
+				return
 
 	def fit(self, states, targets, epochs, verbose, validation_split, batch_size):
-		return self.model.fit(states, targets, epochs=epochs, verbose=verbose, validation_split = validation_split, batch_size = batch_size)
+		fit = self.model.fit(states, targets, epochs=epochs, verbose=verbose, validation_split = validation_split, batch_size = batch_size)
+		self.version += 1
+		return fit
+
+	def get_weights(self):
+		return self.model.get_weights()
+
+	def set_weights(self, weights):
+		self.model.set_weights(weights)
+		self.version += 1
 
 	def write(self, game, version):
 		self.model.save(run_folder + 'models/version' + "{0:0>4}".format(version) + '.h5')
@@ -106,9 +209,12 @@ class Gen_Model():
 		lg.logger_model.info('------------------')
 
 class Densely_connected_net(Gen_Model):
+	numpyInference = True
+
 	def __init__(self, reg_const, learning_rate, input_dim,  output_dim):
 		Gen_Model.__init__(self, reg_const, learning_rate, input_dim, output_dim)
 		self.model = self._build_model()
+		self.prepareThreads()
 
 	def _build_model(self):
 		main_input = Input(shape = self.input_dim, name = 'main_input')
@@ -245,6 +351,7 @@ class Residual_CNN(Gen_Model):
 		self.hidden_layers = hidden_layers
 		self.num_layers = len(hidden_layers)
 		self.model = self._build_model()
+		self.prepareThreads()
 
 	def residual_layer(self, input_block, filters, kernel_size):
 
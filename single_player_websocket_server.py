@@ -2,13 +2,12 @@ import asyncio
 import websockets
 import json
 from aiohttp import web
-from dataclasses import asdict
 import logging
 import argparse
 import uuid
 
 from ExplodingKittensSinglePlayerGym import ExplodingKittensSinglePlayerGym
-from ExplodingKittensGame import Cards
+from ExplodingKittensGame import Cards, game_state_dict
 
 clients = []
 player_numbers = {}
@@ -30,7 +29,7 @@ async def connection_handler(websocket, send_logs):
             logs = f.readlines()
 
     # Send the initial game state to the connected player
-    state = json.dumps({"type": "gameState", "gameState": asdict(gym.game.game_state), "logs": logs})
+    state = json.dumps({"type": "gameState", "gameState": game_state_dict(gym.game.game_state), "logs": logs})
     await websocket.send(state)
 
     clients.append(websocket)
@@ -59,7 +58,7 @@ async def game_handler(websocket, send_logs):
                     logs = f.readlines()
             
             # Broadcast the updated game state to all clients
-            state = json.dumps({"type": "gameState", "gameState": asdict(gym.game.game_state), "logs": logs})
+            state = json.dumps({"type": "gameState", "gameState": game_state_dict(gym.game.game_state), "logs": logs})
             await asyncio.wait([client.send(state) for client in clients])
     finally:
         del clients[websocket]
@@ -0,0 +1,286 @@
+import os
+
+import numpy as np
+
+import MCTS as mc
+from game import Cards, GameState, MAX_CARDS
+
+import config
+
+
+# Search tree snapshots for warm-starting searches of positions seen before.
+#
+# A snapshot file is one .npy array of fixed-width node records, so it can be
+# memory-mapped: loading only reads the records of the trees actually
+# restored, and worker processes share the pages. A file holds any number of
+# trees, each stored breadth-first from its root (parent -1) down to
+# SNAPSHOT_DEPTH levels, with parents before children. A record carries the
+# node's key, statistics, edge block and full game state, so a tree can be
+# rebuilt without replaying any actions.
+#
+# Chance nodes are not stored: a restored edge rebuilds its chance node the
+# first time it is taken and finds its exact outcomes' children in the tree
+# by key. Sampled shuffle orders will not match the stored ones, so the
+# nodes below a shuffle are not reached again.
+
+MAX_EDGES = 11  # one per action
+HAND_SLOTS = Cards.NULL.value  # hands count the cards DEFUSE..CAT5
+NO_CARD = 255
+
+SNAPSHOT_DTYPE = np.dtype([
+    ('key', '<u8'),
+    ('parent', '<i4'),      # record index of the parent within its tree, -1 for the root
+    ('parentEdge', '<i1'),  # slot of the parent's edge leading here, -1 for the root
+    ('visits', '<i4'),
+    ('proven', 'i1'),
+    ('numEdges', 'i1'),
+    ('action', 'i1', (MAX_EDGES,)),
+    ('N', '<i4', (MAX_EDGES,)),
+    ('W', '<f4', (MAX_EDGES,)),
+    ('P', '<f4', (MAX_EDGES,)),
+    ('edgeProven', 'i1', (MAX_EDGES,)),
+    ('deck', 'u1', (MAX_CARDS,)),
+    ('deckSize', 'u1'),
+    ('discard', 'u1', (MAX_CARDS,)),
+    ('discardSize', 'u1'),
+    ('currentHand', 'u1', (HAND_SLOTS,)),
+    ('opposingHand', 'u1', (HAND_SLOTS,)),
+    ('lastPlayed', 'u1'),
+    ('currentPlayer', 'i1'),
+    ('isEndGame', '?'),
+])
+
+
+def _rootKey(mcts):
+    if isinstance(mcts, mc.ArrayMCTS):
+        return mcts.states[mcts.root].hash
+    return mcts.root.id
+
+
+def _walk(mcts, depth, minVisits):
+    # (node, parent record index, parent edge slot) of the top `depth` levels
+    # of the tree, breadth-first. Nodes whose parent edge was taken fewer than
+    # minVisits times are left out with everything below them. (A node's own
+    # visits only count its expansions, so leaves and proven terminals have
+    # none.)
+    if isinstance(mcts, mc.ArrayMCTS):
+        parentNode = mcts._parentNodes()
+        children = {}
+        for node in np.flatnonzero(parentNode >= 0):
+            children.setdefault(int(parentNode[node]), []).append(int(node))
+
+        def slotOf(node):
+            parent = parentNode[node]
+            return int(mcts.parent[node] - mcts.firstEdge[parent])
+
+        def visitsOf(node):
+            return mcts.N[mcts.parent[node]]
+    else:
+        children = {}
+        for node in mcts.tree.values():
+            if node.parent is not None:
+                children.setdefault(node.parent, []).append(node)
+
+        def slotOf(node):
+            return -1 if node.parentIdx is None else node.parentIdx
+
+        def visitsOf(node):
+            if node.parentIdx is None:
+                return minVisits
+            return node.parent.N[node.parentIdx]
+
+    level = [(mcts.root, -1, -1)]
+    walked = []
+    for _ in range(depth + 1):
+        nextLevel = []
+        for node, parent, slot in level:
+            walked.append((node, parent, slot))
+            index = len(walked) - 1
+            nextLevel += [(child, index, slotOf(child)) for child in children.get(node, [])
+                          if visitsOf(child) >= minVisits]
+        level = nextLevel
+    return walked
+
+
+def _encode(mcts, walked):
+    records = np.zeros(len(walked), dtype=SNAPSHOT_DTYPE)
+    records['deck'] = NO_CARD
+    records['discard'] = NO_CARD
+    for record, (node, parent, slot) in zip(records, walked):
+        state = mcts.stateOf(node)
+        record['parent'] = parent
+        record['parentEdge'] = slot
+
+        if isinstance(mcts, mc.ArrayMCTS):
+            record['key'] = state.hash
+            record['visits'] = mcts.visits[node]
+            record['proven'] = mcts.proven[node]
+            first = mcts.firstEdge[node]
+            edges = slice(first, first + mcts.numEdges[node])
+            stats = (mcts.action[edges], mcts.N[edges], mcts.W[edges], mcts.P[edges],
+                     mcts.edgeProven[edges])
+        else:
+            record['key'] = node.id
+            record['visits'] = node.visits
+            record['proven'] = node.proven
+            stats = None
+            if not node.isLeaf():
+                stats = ([action for action, _ in node.edges], node.N, node.W, node.P,
+                         node.edgeProven)
+
+        if stats is not None:
+            n = len(stats[0])
+            record['numEdges'] = n
+            for name, values in zip(['action', 'N', 'W', 'P', 'edgeProven'], stats):
+                record[name][:n] = values
+
+        record['deck'][:len(state.deck)] = [card.value for card in state.deck]
+        record['deckSize'] = len(state.deck)
+        record['discard'][:len(state.discard)] = [card.value for card in state.discard]
+        record['discardSize'] = len(state.discard)
+        record['currentHand'] = state.currentHand
+        record['opposingHand'] = state.opposingHand
+        record['lastPlayed'] = state.lastPlayedCard.value \
+            if state.lastPlayedCard != None else NO_CARD
+        record['currentPlayer'] = state.currentPlayer
+        record['isEndGame'] = state.isEndGame
+    return records
+
+
+def _decodeState(record):
+    deck = [Cards(int(value)) for value in record['deck'][:record['deckSize']]]
+    discard = [Cards(int(value)) for value in record['discard'][:record['discardSize']]]
+    lastPlayed = Cards(int(record['lastPlayed'])) if record['lastPlayed'] != NO_CARD else None
+    state = GameState(deck, record['currentHand'].tolist(), record['opposingHand'].tolist(),
+                      discard, lastPlayed, int(record['currentPlayer']))
+    state.isEndGame = bool(record['isEndGame'])
+    return state
+
+
+def takeSnapshot(mcts, depth=None, minVisits=None):
+    # The records of the top `depth` levels of mcts (MCTS, ISMCTS or
+    # ArrayMCTS), for saveSnapshot. Taken straight after a search, since the
+    # tree is pruned as the game moves on. depth and minVisits default to
+    # SNAPSHOT_DEPTH and SNAPSHOT_MIN_VISITS.
+    if depth is None:
+        depth = config.SNAPSHOT_DEPTH
+    if minVisits is None:
+        minVisits = config.SNAPSHOT_MIN_VISITS
+    return _encode(mcts, _walk(mcts, depth, minVisits))
+
+
+def saveSnapshot(path, blocks, maxTrees=None):
+    # Write the trees of `blocks` (from takeSnapshot) to `path`. Trees already
+    # in the file are kept, unless one of `blocks` has the same root; of
+    # blocks sharing a root, the last one is kept. The file holds its trees
+    # newest first and keeps only the newest maxTrees (default
+    # SNAPSHOT_MAX_TREES, 0 = no limit).
+    if maxTrees is None:
+        maxTrees = config.SNAPSHOT_MAX_TREES
+    latest = {}
+    for block in reversed(blocks):
+        latest.setdefault(int(block[0]['key']), block)
+    blocks = list(latest.values())
+    old = SnapshotLibrary(path)
+    blocks += [np.array(old.records[start:end]) for key, (start, end)
+               in old.index.items() if key not in latest]
+    if maxTrees:
+        blocks = blocks[:maxTrees]
+    records = np.concatenate(blocks) if blocks else np.zeros(0, dtype=SNAPSHOT_DTYPE)
+
+    # written aside and moved into place, so processes that have the old file
+    # mapped keep reading it; np.save would add .npy to a path without it
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, records)
+    os.replace(path + '.tmp', path)
+    return len(records)
+
+
+class SnapshotLibrary():
+    # The trees of a snapshot file, memory-mapped and indexed by root key.
+
+    # A missing file is an empty library; the file is reread when it changes,
+    # so agents built before the first save pick the trees up.
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.records = np.zeros(0, dtype=SNAPSHOT_DTYPE)
+        self.index = {}
+        self.reload()
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.mtime:
+            return
+        self.mtime = mtime
+        if mtime is None:
+            self.records = np.zeros(0, dtype=SNAPSHOT_DTYPE)
+        else:
+            self.records = np.load(self.path, mmap_mode='r')
+        roots = np.flatnonzero(self.records['parent'] == -1)
+        ends = np.append(roots[1:], len(self.records))
+        self.index = {int(self.records[start]['key']): (int(start), int(end))
+                      for start, end in zip(roots, ends)}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def restore(self, mcts):
+        # Rebuild the stored tree for mcts's root into mcts, which should be
+        # freshly built. Returns the number of nodes restored (0 if the root
+        # is not in the library).
+        self.reload()
+        span = self.index.get(_rootKey(mcts))
+        if span is None:
+            return 0
+        records = np.array(self.records[span[0]:span[1]])
+
+        isArray = isinstance(mcts, mc.ArrayMCTS)
+        nodes = []
+        for record in records:
+            if record['parent'] == -1:
+                node = mcts.root
+            else:
+                parent = nodes[record['parent']]
+                state = _decodeState(record)
+                if isArray:
+                    edge = int(mcts.firstEdge[parent]) + int(record['parentEdge'])
+                    node = mcts.addNode(state, edge)
+                    mcts.child[edge] = node
+                else:
+                    node = mc.Node(state, int(record['key']))
+                    node.parent = parent
+                    if record['parentEdge'] >= 0:
+                        node.parentIdx = int(record['parentEdge'])
+                        parent.edges[node.parentIdx][1].outNodes.add(node)
+                    mcts.addNode(node)
+            nodes.append(node)
+
+            n = record['numEdges']
+            if n > 0:
+                mcts.expand(node, record['action'][:n].astype(int).tolist(), record['P'][:n])
+                N, W = record['N'][:n], record['W'][:n]
+                Q = np.where(N > 0, W / np.maximum(N, 1), 0)
+                if isArray:
+                    first = mcts.firstEdge[node]
+                    edges = slice(first, first + n)
+                    mcts.N[edges], mcts.W[edges], mcts.Q[edges] = N, W, Q
+                    mcts.edgeProven[edges] = record['edgeProven'][:n]
+                else:
+                    node.N[:], node.W[:], node.Q[:] = N, W, Q
+                    node.edgeProven[:] = record['edgeProven'][:n]
+
+            if isArray:
+                mcts.visits[node] = record['visits']
+                mcts.proven[node] = record['proven']
+            else:
+                node.visits = int(record['visits'])
+                node.proven = int(record['proven'])
+        return len(records)
@@ -2,12 +2,11 @@ import asyncio
 import websockets
 import json
 from aiohttp import web
-from dataclasses import asdict
 import logging
 import argparse
 import uuid
 
-from ExplodingKittensGame import ExplodingKittensGame
+from ExplodingKittensGame import ExplodingKittensGame, game_state_dict
 
 # clients = {}
 clients = []
@@ -44,7 +43,7 @@ async def connection_handler(websocket, send_logs):
             logs = f.readlines()
 
     # Send the initial game state to the connected player
-    state = json.dumps({"type": "gameState", "gameState": asdict(game.game_state), "logs": logs})
+    state = json.dumps({"type": "gameState", "gameState": game_state_dict(game.game_state), "logs": logs})
     await websocket.send(state)
 
     # clients[websocket] = client_id
@@ -72,7 +71,7 @@ async def game_handler(websocket, send_logs):
                     logs = f.readlines()
             
             # Broadcast the updated game state to all clients
-            state = json.dumps({"type": "gameState", "gameState": asdict(game.game_state), "logs": logs})
+            state = json.dumps({"type": "gameState", "gameState": game_state_dict(game.game_state), "logs": logs})
             await asyncio.wait([client.send(state) for client in clients])
     finally:
         del clients[websocket]